@@ -1,77 +1,178 @@
 import os
 import re
+import time
 import logging
+import threading
 from dotenv import load_dotenv
-from deepeval.metrics import FaithfulnessMetric
-from deepeval.test_case import LLMTestCase
-from src.tools.deepeval_adapter import GroqDeepEvalLLM
-from langchain_groq import ChatGroq
+from src.agents.verifier import verify_claims, PASS, UNDECIDED
+from src.agents.state import latest_evidence, latest_analysis
+from src.tools.model_cascade import run_cascade, arun_cascade
 
 load_dotenv()
 logger = logging.getLogger(__name__)
-faith_metric = FaithfulnessMetric(threshold=0.75, model=GroqDeepEvalLLM())
 
-def auditor_node(state: dict):
-    # Retrieve necessary information and judge the evidence
+FAITHFULNESS_THRESHOLD = 0.75
+# The judge only runs when the deterministic verifier is UNDECIDED. Its answer goes to the next judge tier
+# only when it is borderline (below the threshold by less than this margin) or when the judge gave no score
+# at all; a clearly unfaithful answer goes straight back to the retry loop.
+JUDGE_ESCALATION_MARGIN = float(os.getenv("JUDGE_ESCALATION_MARGIN", "0.25"))
+
+# One judge per tier of the "judge" cascade.
+# DeepEval is imported with the first judge: audits settled by the deterministic verifier never load it.
+_judges = {}
+_judges_lock = threading.Lock()
+
+def get_judge(tier: int = 0):
+    with _judges_lock:
+        if tier not in _judges:
+            from src.tools.deepeval_adapter import GroqDeepEvalLLM
+            _judges[tier] = GroqDeepEvalLLM(tier)
+        return _judges[tier]
+
+def new_faith_metric(tier: int = 0):
+    # The metric keeps score/claims/verdicts on the instance, so concurrent audits each need their own
+    from deepeval.metrics import FaithfulnessMetric
+    return FaithfulnessMetric(threshold=FAITHFULNESS_THRESHOLD, model=get_judge(tier), async_mode=True)
+
+def judge_accepted(measured) -> bool:
+    score = measured[0]
+    if score is None:
+        return False
+    return score >= FAITHFULNESS_THRESHOLD or score < FAITHFULNESS_THRESHOLD - JUDGE_ESCALATION_MARGIN
+
+MAX_RETRIES = 3
+
+def build_test_case(state: dict):
+    from deepeval.test_case import LLMTestCase
+
     query = state["query"]
     final_output = state.get("final_hscode", "")
-    if not final_output:
-        return {"status": "REVISE", "critique": "No aggregator output found to audit."}
-
     claims_to_verify = state.get("verification_claims", "") or final_output
     logger.info(f"Auditor: Claims to verify:\n{claims_to_verify}")
     
-    retrieval_ctx = state.get("retrieval_context", [])
-    raw_evidence_only = []
-    for i in range(0, len(retrieval_ctx), 2):
-        if i < len(retrieval_ctx):
-            raw_evidence_only.append(retrieval_ctx[i])
-    recent_evidence = raw_evidence_only[-1:] if raw_evidence_only else []
-
-    test_case = LLMTestCase(
+    evidence = latest_evidence(state)
+    recent_evidence = [evidence] if evidence else []
+
+    return LLMTestCase(
         input=query,
         actual_output=claims_to_verify,
         retrieval_context=recent_evidence
     )
-    
-    MAX_RETRIES = 3
-    score = 0.0
-    for attempt in range(MAX_RETRIES):
-        try:
-            faith_metric.measure(test_case)
-            score = faith_metric.score
-            # Log detailed claim
-            if hasattr(faith_metric, 'claims') and faith_metric.claims:
-                logger.info(f"DeepEval extracted {len(faith_metric.claims)} claims: {faith_metric.claims}")
-            if hasattr(faith_metric, 'verdicts') and faith_metric.verdicts:
-                for i, verdict in enumerate(faith_metric.verdicts):
-                    v = verdict.verdict if hasattr(verdict, 'verdict') else str(verdict)
-                    r = verdict.reason if hasattr(verdict, 'reason') else ''
-                    logger.info(f"  Claim {i+1}: {v} — {r}")
-            if hasattr(faith_metric, 'reason') and faith_metric.reason:
-                logger.info(f"DeepEval reason: {faith_metric.reason}")
-            break
-        except (ValueError, Exception) as e:
-            logger.warning(f"DeepEval attempt {attempt + 1}/{MAX_RETRIES} failed: {e}")
-            if attempt == MAX_RETRIES - 1:
-                logger.error("DeepEval evaluation failed after all retries. Using fallback score 0.0.")
-                score = 0.0
-    
-    current_tokens = state.get("total_tokens", 0)
 
-    if score >= 0.75:
-        logger.info(f"DeepEval PASSED: {score}")
+def log_metric_details(faith_metric):
+    # Log detailed claim
+    if hasattr(faith_metric, 'claims') and faith_metric.claims:
+        logger.info(f"DeepEval extracted {len(faith_metric.claims)} claims: {faith_metric.claims}")
+    if hasattr(faith_metric, 'verdicts') and faith_metric.verdicts:
+        for i, verdict in enumerate(faith_metric.verdicts):
+            v = verdict.verdict if hasattr(verdict, 'verdict') else str(verdict)
+            r = verdict.reason if hasattr(verdict, 'reason') else ''
+            logger.info(f"  Claim {i+1}: {v} — {r}")
+    if hasattr(faith_metric, 'reason') and faith_metric.reason:
+        logger.info(f"DeepEval reason: {faith_metric.reason}")
+
+def audit_update(state: dict, score: float, reason, path: str, started: float, tier: dict = None) -> dict:
+    elapsed = time.perf_counter() - started
+    logger.info(f"Auditor: decided by {path} in {elapsed * 1000:.1f}ms")
+    tiers = {"model_tiers": {"auditor": tier}} if tier else {}
+
+    if score >= FAITHFULNESS_THRESHOLD:
+        logger.info(f"{path} PASSED: {score}")
         return {
             "status": "APPROVED",
             "faithfulness_score": score,
             "critique": f"Verified accuracy: {score}",
-            "total_tokens": current_tokens
+            "audit_path": path,
+            "audit_seconds": elapsed,
+            **tiers
         }
     else:
-        logger.warning(f"DeepEval FAILED: {score}")
+        logger.warning(f"{path} FAILED: {score}")
         return {
             "status": "REVISE",
             "faithfulness_score": score,
-            "critique": f"Faithfulness check failed. Score {score}. {faith_metric.reason}",
-            "total_tokens": current_tokens
-        }
\ No newline at end of file
+            "critique": f"Faithfulness check failed. Score {score}. {reason}",
+            "audit_path": path,
+            "audit_seconds": elapsed,
+            **tiers
+        }
+
+def deterministic_verdict(state: dict):
+    # Rule-based fast path: (score, reason) when FINAL_CODE and the quoted line settle it, else None
+    verdict, reason = verify_claims(
+        state.get("final_hscode", ""),
+        latest_analysis(state),
+        latest_evidence(state)
+    )
+    logger.info(f"Auditor: deterministic verifier says {verdict} — {reason}")
+    if verdict == UNDECIDED:
+        return None
+    return (1.0 if verdict == PASS else 0.0), reason
+
+def measure(test_case, tier: int = 0):
+    # (score, metric) from one judge tier; score is None when every retry failed
+    faith_metric = new_faith_metric(tier)
+    score = None
+    for attempt in range(MAX_RETRIES):
+        try:
+            faith_metric.measure(test_case)
+            score = faith_metric.score
+            log_metric_details(faith_metric)
+            break
+        except (ValueError, Exception) as e:
+            logger.warning(f"DeepEval attempt {attempt + 1}/{MAX_RETRIES} failed: {e}")
+            if attempt == MAX_RETRIES - 1:
+                logger.error("DeepEval evaluation failed after all retries. No score.")
+                score = None
+    return score, faith_metric
+
+async def ameasure(test_case, tier: int = 0):
+    # Same, through a_measure so the judge calls use GroqDeepEvalLLM.a_generate
+    faith_metric = new_faith_metric(tier)
+    score = None
+    for attempt in range(MAX_RETRIES):
+        try:
+            await faith_metric.a_measure(test_case)
+            score = faith_metric.score
+            log_metric_details(faith_metric)
+            break
+        except (ValueError, Exception) as e:
+            logger.warning(f"DeepEval attempt {attempt + 1}/{MAX_RETRIES} failed: {e}")
+            if attempt == MAX_RETRIES - 1:
+                logger.error("DeepEval evaluation failed after all retries. No score.")
+                score = None
+    return score, faith_metric
+
+NO_OUTPUT = {"status": "REVISE", "critique": "No aggregator output found to audit."}
+
+def auditor_node(state: dict):
+    # Retrieve necessary information and judge the evidence
+    started = time.perf_counter()
+    if not state.get("final_hscode"):
+        return dict(NO_OUTPUT)
+
+    decided = deterministic_verdict(state)
+    if decided is not None:
+        return audit_update(state, decided[0], decided[1], "deterministic", started)
+
+    test_case = build_test_case(state)
+
+    (score, faith_metric), tier = run_cascade("judge", lambda t: measure(test_case, t), judge_accepted)
+    # No judge tier produced a score: treat it as failing (0.0) so the answer is revised, not approved
+    return audit_update(state, score or 0.0, getattr(faith_metric, "reason", ""), "deepeval", started, tier)
+
+async def aauditor_node(state: dict):
+    # Same audit, but DeepEval runs through a_measure so the judge calls use GroqDeepEvalLLM.a_generate
+    started = time.perf_counter()
+    if not state.get("final_hscode"):
+        return dict(NO_OUTPUT)
+
+    decided = deterministic_verdict(state)
+    if decided is not None:
+        return audit_update(state, decided[0], decided[1], "deterministic", started)
+
+    test_case = build_test_case(state)
+
+    (score, faith_metric), tier = await arun_cascade("judge", lambda t: ameasure(test_case, t), judge_accepted)
+    # No judge tier produced a score: treat it as failing (0.0) so the answer is revised, not approved
+    return audit_update(state, score or 0.0, getattr(faith_metric, "reason", ""), "deepeval", started, tier)
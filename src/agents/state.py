@@ -1,20 +1,98 @@
+import os
 import operator
 from typing import Annotated, List, TypedDict
-from pydantic import BaseModel, Field
+
+# Evidence records kept across recursive attempts; older ones (and chunks only they referenced) are dropped
+MAX_EVIDENCE_RECORDS = int(os.getenv("MAX_EVIDENCE_RECORDS", "4"))
+
+
+def merge_evidence(current: dict, update: dict) -> dict:
+    # Reducer for AuditorState.evidence = {"records": [...], "chunks": {node_id: text}}.
+    # Records reference chunks by node id, so a chunk retrieved on several attempts (or by several
+    # parallel workers) is stored once, and the whole value stays bounded however many loops run.
+    current = current or {"records": [], "chunks": {}}
+    update = update or {"records": [], "chunks": {}}
+    records = (current.get("records", []) + update.get("records", []))[-MAX_EVIDENCE_RECORDS:]
+    chunks = {**current.get("chunks", {}), **update.get("chunks", {})}
+    referenced = {node_id for record in records for node_id in record["node_ids"]}
+    return {"records": records, "chunks": {k: v for k, v in chunks.items() if k in referenced}}
+
+
+def keep_latest_attempt(current: list, update: list) -> list:
+    # Reducer for AuditorState.retrievals: the parallel retrievers of one round each append their result;
+    # results from earlier rounds are dropped once a newer round starts writing
+    merged = (current or []) + (update or [])
+    if not merged:
+        return []
+    attempt = max(item["attempt"] for item in merged)
+    return [item for item in merged if item["attempt"] == attempt]
+
+
+def merge_tiers(current: dict, update: dict) -> dict:
+    # Reducer for AuditorState.model_tiers: {node: tier record} of the tier that answered each node last
+    return {**(current or {}), **(update or {})}
+
+
+def evidence_record(attempt: int, query: str, chunks: list, analysis: str, codes: list) -> dict:
+    # One worker run. chunks: [(node_id, text)] in rank order.
+    return {
+        "records": [{
+            "attempt": attempt,
+            "query": query,
+            "node_ids": [node_id for node_id, _ in chunks],
+            "codes": codes,
+            "analysis": analysis,
+        }],
+        "chunks": {node_id: text for node_id, text in chunks},
+    }
+
+
+def latest_records(state: dict) -> list:
+    # Every record from the most recent attempt (one per worker that ran in it)
+    records = (state.get("evidence") or {}).get("records", [])
+    if not records:
+        return []
+    attempt = max(record["attempt"] for record in records)
+    return [record for record in records if record["attempt"] == attempt]
+
+
+def latest_chunks(state: dict) -> list:
+    # [(node_id, text)] of the most recent attempt, each chunk once, in rank order
+    chunks = (state.get("evidence") or {}).get("chunks", {})
+    seen, latest = set(), []
+    for record in latest_records(state):
+        for node_id in record["node_ids"]:
+            if node_id not in seen and node_id in chunks:
+                seen.add(node_id)
+                latest.append((node_id, chunks[node_id]))
+    return latest
+
+
+def latest_evidence(state: dict) -> str:
+    return "\n---\n".join(text for _, text in latest_chunks(state))
+
+
+def latest_analysis(state: dict) -> str:
+    return "\n\n".join(record["analysis"] for record in latest_records(state) if record.get("analysis"))
+
 
 class AuditorState(TypedDict):
     query: str
-    worker_results: Annotated[List[str], operator.add]
     sub_tasks: List[str]
     final_hscode: str
     final_confidence: str
     verification_claims: str
     step_count: Annotated[int, operator.add]
     faithfulness_score: float
+    audit_path: str
+    audit_seconds: float
     status: str
     critique: str
-    total_tokens: int
-    retrieval_context: Annotated[List[str], operator.add]
+    total_tokens: Annotated[int, operator.add]
+    evidence: Annotated[dict, merge_evidence]
+    retrievals: Annotated[list, keep_latest_attempt]
+    model_tiers: Annotated[dict, merge_tiers]
 
-class WorkerInput(TypedDict):
-    query: str
\ No newline at end of file
+class RetrievalInput(TypedDict):
+    query: str
+    attempt: int
@@ -4,26 +4,25 @@ from typing import List, Literal
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 
-from langchain_groq import ChatGroq
 from langgraph.constants import Send
-from src.agents.state import AuditorState
+from src.agents.state import AuditorState, latest_evidence, latest_analysis, latest_chunks
+from src.ingestion.hs_codes import get_code_table
+from src.tools.llm_calls import invoke_llm, ainvoke_llm
+from src.tools.model_cascade import model_tiers, get_model, run_cascade, arun_cascade
+from src.tools.evidence_packer import pack_chunks, pack_analysis, AGGREGATOR_EVIDENCE_TOKENS, AGGREGATOR_ANALYSIS_TOKENS
 import logging
 
 logger = logging.getLogger(__name__)
 
 load_dotenv()
-RUN_MODE = os.getenv("RUN_MODE", "cloud")
-if RUN_MODE == "local":
-    model_name = os.getenv("LOCAL_GROQ_MODEL")
-    from langchain_ollama import ChatOllama
-    llm_factory = lambda: ChatOllama(model=model_name, base_url=os.getenv("OLLAMA_BASE_URL"))
-else:
-    model_name = os.getenv("CLOUD_GROQ_MODEL")
-    llm_factory = lambda: ChatGroq(model=model_name, temperature=0, verbose=True)
+# The aggregator's evidence is packed for its first (smallest) tier; escalated tiers read the same prompt
+model_name = model_tiers("aggregator")[0]
+
+# Search queries planned per round; each runs as its own retrieval worker, in parallel
+PLAN_QUERIES = max(1, int(os.getenv("PLAN_QUERIES", "3")))
 
 class TriagePlan(BaseModel):
-    # I put this as triage plan because I used to implement parralel workers, but then changed to single worker due to hardware limitations. 
-    search_query: str = Field(description="One targeted, specific search query focusing on a unique technical characteristic or specific HS heading. Avoid broad queries.")
+    search_queries: List[str] = Field(description=f"Up to {PLAN_QUERIES} distinct, specific search queries, each from a different angle: the core product noun, its defining technical characteristic, and the most likely HS heading. Avoid broad queries.")
 
 class AuditReview(BaseModel):
     status: Literal["APPROVED", "REVISE"] = Field(description="Decision to finish or retry")
@@ -37,9 +36,7 @@ def load_prompt(filename: str) -> str:
     with open(path, "r") as f:
         return f.read()
 
-# Graph nodes
-def supervisor_node(state: AuditorState):
-    llm = llm_factory().with_structured_output(TriagePlan)
+def build_plan_prompt(state: AuditorState) -> str:
     strategy_content = load_prompt("strategy.md")
 
     # Use critique from previous attempt if any
@@ -47,39 +44,57 @@ def supervisor_node(state: AuditorState):
     if state.get("critique"):
         critique_context = f"\n\nIMPORTANT - PREVIOUS ATTEMPT FAILED:\nCritique: {state['critique']}\nADJUSTMENT REQUIRED: Be more specific than the last attempt."
 
-    filled_prompt = f"""
+    return f"""
     {strategy_content}
     
     --- CURRENT CONTEXT ---
     User Query: {state['query']}
     {critique_context}
     
-    TASK: Generate ONE single, highly specific search query. 
-    Focus on the unique technical characteristic or specific HS heading.
+    TASK: Generate up to {PLAN_QUERIES} highly specific search queries that do not overlap.
+    Cover different angles: the core product noun, the unique technical characteristic, the likely HS heading.
     """
-    
-    plan = llm.invoke(filled_prompt)
-    
+
+def plan_accepted(plan: TriagePlan) -> bool:
+    return any(query.strip() for query in plan.search_queries or [])
+
+def plan_update(plan: TriagePlan, state: AuditorState, tier: dict) -> dict:
     print(f"--- SUPERVISOR PLAN ---\nQuery Breakdown: {plan}")
     logger.info(f"Supervisor Plan generated: {plan}")
 
-    return {"sub_tasks": [plan.search_query], "status": "PLANNING"}
+    # Drop blanks and repeats, cap at PLAN_QUERIES; fall back to the product itself if nothing usable came back
+    queries, seen = [], set()
+    for query in plan.search_queries or []:
+        key = " ".join(query.lower().split())
+        if key and key not in seen:
+            seen.add(key)
+            queries.append(query.strip())
+    return {"sub_tasks": queries[:PLAN_QUERIES] or [state["query"]], "status": "PLANNING", "model_tiers": {"supervisor": tier}}
+
+# Graph nodes. A plan that fails to parse or comes back empty escalates to the next supervisor tier.
+def supervisor_node(state: AuditorState):
+    prompt = build_plan_prompt(state)
+    plan, tier = run_cascade("supervisor", lambda t: invoke_llm(get_model("supervisor", t), prompt, schema=TriagePlan), plan_accepted)
+    return plan_update(plan, state, tier)
+
+async def asupervisor_node(state: AuditorState):
+    prompt = build_plan_prompt(state)
+    plan, tier = await arun_cascade("supervisor", lambda t: ainvoke_llm(get_model("supervisor", t), prompt, schema=TriagePlan), plan_accepted)
+    return plan_update(plan, state, tier)
 
 
 def supervisor_review_node(state: AuditorState):
     # Inspect worker output for quality and relevance
 
-    worker_results = state.get("worker_results", [])
-    if not worker_results:
+    latest_result = latest_analysis(state)
+    if not latest_result:
         logger.warning("Supervisor Review: No worker results to inspect.")
         return {"status": "REVISE", "critique": "No worker results found."}
 
-    latest_result = worker_results[-1]
     query = state.get("query", "")
 
     # Check raw evidence quality
-    retrieval_ctx = state.get("retrieval_context", [])
-    raw_evidence = retrieval_ctx[-2] if len(retrieval_ctx) >= 2 else ""
+    raw_evidence = latest_evidence(state)
 
     if not raw_evidence or raw_evidence.strip() == "":
         logger.warning("Supervisor Review: Empty evidence retrieved.")
@@ -116,6 +131,16 @@ def supervisor_review_node(state: AuditorState):
             }
     elif six_digit:
         heading = six_digit[0]
+        table = get_code_table()
+        if table is not None and table.lines_under(heading):
+            # Known heading: expand it straight from the code table instead of another planned search round
+            logger.warning(f"Supervisor Review: Only 6-digit heading {heading} found. Expanding it from the code table.")
+            return {
+                "status": "EXPAND",
+                "sub_tasks": [f"8-digit national tariff lines under heading {heading}"],
+                "step_count": 1,
+                "critique": f"Only found 6-digit heading {heading}. Pick the exact 8-digit line from the expanded heading."
+            }
         logger.warning(f"Supervisor Review: Only 6-digit heading {heading} found. Sending worker back.")
         return {
             "status": "REVISE",
@@ -135,6 +160,10 @@ def supervisor_review_router(state: AuditorState):
     status = state.get("status", "APPROVED")
     step_count = state.get("step_count", 0)
 
+    if status == "EXPAND" and step_count <= 3:
+        logger.info(f"Supervisor re-dispatching worker on expanded heading. Attempt: {step_count}")
+        return route_to_workers(state)
+
     if status == "REVISE" and step_count < 3:
         logger.info(f"Supervisor sending worker back for deeper search. Attempt: {step_count + 1}")
         return "pacer"
@@ -142,31 +171,30 @@ def supervisor_review_router(state: AuditorState):
     return "aggregator"
 
 
-def aggregator_node(state: AuditorState):
-    # Synthesize worker findings into final code decision
-
-    llm = llm_factory()
-
+def build_synthesis_prompt(state: AuditorState):
+    # Returns None when there is nothing for the aggregator to judge
     # Load the synthesis prompt template
     try:
         synthesis_template = load_prompt("final_synthesis.md")
     except:
         synthesis_template = "Evaluate and classify based on the evidence."
 
-    worker_results = state.get("worker_results", [])
-    latest_result = worker_results[-1] if worker_results else ""
-
-    retrieval_ctx = state.get("retrieval_context", [])
-    raw_evidence = retrieval_ctx[-2] if len(retrieval_ctx) >= 2 else ""
+    latest_result = latest_analysis(state)
 
     if not latest_result:
-        logger.warning("Aggregator: No worker results to evaluate.")
-        return {"final_hscode": "INSUFFICIENT DATA - MANUAL REVIEW REQUIRED", "final_confidence": "LOW"}
+        return None
 
     worker_8digit = re.findall(r'\b(\d{4}\.\d{2}\.\d{2})\b', latest_result)
     worker_code = worker_8digit[0] if worker_8digit else "N/A"
 
-    filled_prompt = f"""
+    # Both inputs are packed to the aggregator's token budget; chunks carrying the worker's code go first
+    # so the line it has to confirm is never the one dropped
+    chunks = sorted(latest_chunks(state), key=lambda chunk: worker_code not in chunk[1])
+    chunks = pack_chunks(chunks, AGGREGATOR_EVIDENCE_TOKENS, model_name, label="aggregator")
+    raw_evidence = "\n---\n".join(text for _, text in chunks)
+    latest_result = pack_analysis(latest_result, AGGREGATOR_ANALYSIS_TOKENS, model_name)
+
+    return f"""
 {synthesis_template}
 
 --- INPUT DATA ---
@@ -183,14 +211,24 @@ Raw Retrieved Evidence (from STCCED tariff schedule):
 REMINDER: Your FINAL_CODE line MUST contain a full 8-digit code (XXXX.XX.XX). Use the worker's proposed code '{worker_code}' if it appears in the raw evidence. If not, find the correct 8-digit code from the evidence.
 """
 
-    response = llm.invoke(filled_prompt)
-    content = response.content
-
-    confidence = "LOW"
+def confidence_of(content: str) -> str:
     for level in ["HIGH", "MEDIUM", "LOW"]:
         if level in content.upper():
-            confidence = level
-            break
+            return level
+    return "LOW"
+
+def synthesis_accepted(state: AuditorState):
+    # What supervisor_post_aggregator_node would reject (no FINAL_CODE, or one not in the evidence), plus LOW
+    # confidence, sends the synthesis to the next aggregator tier
+    codes_in_evidence = set(re.findall(r'\b(\d{4}\.\d{2}\.\d{2})\b', latest_evidence(state)))
+
+    def accept(response) -> bool:
+        match = re.search(r'FINAL_CODE:\s*(\d{4}\.\d{2}\.\d{2})', response.content)
+        return bool(match) and match.group(1) in codes_in_evidence and confidence_of(response.content) != "LOW"
+    return accept
+
+def synthesis_update(content: str, tier: dict) -> dict:
+    confidence = confidence_of(content)
 
     logger.info(f"Aggregator: Judged evidence with confidence={confidence}")
 
@@ -203,7 +241,29 @@ REMINDER: Your FINAL_CODE line MUST contain a full 8-digit code (XXXX.XX.XX). Us
         verification_claims = content
         logger.warning("Aggregator: No VERIFICATION_CLAIMS section found, using full output.")
 
-    return {"final_hscode": content, "final_confidence": confidence, "verification_claims": verification_claims}
+    return {"final_hscode": content, "final_confidence": confidence, "verification_claims": verification_claims,
+            "model_tiers": {"aggregator": tier}}
+
+NO_SYNTHESIS = {"final_hscode": "INSUFFICIENT DATA - MANUAL REVIEW REQUIRED", "final_confidence": "LOW"}
+
+def aggregator_node(state: AuditorState):
+    # Synthesize worker findings into final code decision
+    filled_prompt = build_synthesis_prompt(state)
+    if filled_prompt is None:
+        logger.warning("Aggregator: No worker results to evaluate.")
+        return dict(NO_SYNTHESIS)
+
+    response, tier = run_cascade("aggregator", lambda t: invoke_llm(get_model("aggregator", t), filled_prompt), synthesis_accepted(state))
+    return synthesis_update(response.content, tier)
+
+async def aaggregator_node(state: AuditorState):
+    filled_prompt = build_synthesis_prompt(state)
+    if filled_prompt is None:
+        logger.warning("Aggregator: No worker results to evaluate.")
+        return dict(NO_SYNTHESIS)
+
+    response, tier = await arun_cascade("aggregator", lambda t: ainvoke_llm(get_model("aggregator", t), filled_prompt), synthesis_accepted(state))
+    return synthesis_update(response.content, tier)
 
 
 def supervisor_post_aggregator_node(state: AuditorState):
@@ -220,8 +280,7 @@ def supervisor_post_aggregator_node(state: AuditorState):
 
     final_code = final_code_match.group(1)
 
-    retrieval_ctx = state.get("retrieval_context", [])
-    raw_evidence = retrieval_ctx[-2] if len(retrieval_ctx) >= 2 else ""
+    raw_evidence = latest_evidence(state)
     codes_in_evidence = set(re.findall(r'\b(\d{4}\.\d{2}\.\d{2})\b', raw_evidence))
 
     if final_code in codes_in_evidence:
@@ -229,6 +288,13 @@ def supervisor_post_aggregator_node(state: AuditorState):
         return {"status": "APPROVED"}
     else:
         logger.warning(f"Supervisor Post-Aggregator: FAILED — {final_code} NOT in evidence. Evidence has: {codes_in_evidence}")
+        table = get_code_table()
+        if table is not None and table.get(final_code):
+            # The code is real, just not retrieved: point the next search at its heading so it gets expanded exactly
+            return {
+                "status": "REVISE",
+                "critique": f"Aggregator cited {final_code}, a real tariff line that was not in the retrieved evidence. Search for '8-digit national tariff lines under heading {final_code[:7]}' and confirm it against the expanded lines."
+            }
         return {
             "status": "REVISE",
             "critique": f"Aggregator hallucinated code {final_code} which does not exist in the retrieved evidence. Evidence contains: {list(codes_in_evidence)[:5]}. Re-search and use only codes from the evidence."
@@ -246,5 +312,31 @@ def supervisor_post_aggregator_router(state: AuditorState):
     
     return "auditor"
 
+def retrieval_payload(state: AuditorState, task: str) -> dict:
+    # Each retriever tags its result with the round it belongs to, so the analysis pass only merges this round's
+    return {"query": task, "attempt": state.get("step_count", 0)}
+
 def route_to_workers(state: AuditorState):
-    return [Send("worker_node", {"query": task}) for task in state["sub_tasks"]]
\ No newline at end of file
+    # One retrieval worker per planned query; the analysis worker runs once they have all finished
+    return [Send("retriever", retrieval_payload(state, task)) for task in state["sub_tasks"]]
+
+def critique_search_query(critique: str):
+    # Critiques that already name what to search for don't need another planning call
+    if not critique:
+        return None
+    quoted = re.search(r"[Ss]earch (?:specifically )?for '([^']+)'", critique)
+    if quoted:
+        return quoted.group(1)
+    heading = re.search(r'\bheading (\d{4}\.\d{2})\b', critique)
+    if heading:
+        return f"8-digit national tariff lines under heading {heading.group(1)}"
+    return None
+
+def route_after_pacer(state: AuditorState):
+    # Specific critique → straight back to the worker with the derived query (no supervisor LLM call);
+    # vague critique → the supervisor plans a new query as before
+    task = critique_search_query(state.get("critique", ""))
+    if task:
+        logger.info(f"Critique-guided re-search: '{task}' (reusing {len((state.get('evidence') or {}).get('chunks', {}))} pooled chunks)")
+        return [Send("retriever", retrieval_payload(state, task))]
+    return "supervisor"
\ No newline at end of file
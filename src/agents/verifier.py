@@ -0,0 +1,103 @@
+import re
+import logging
+from src.ingestion.hs_codes import CODE_PATTERN, UNIT_PATTERN
+
+logger = logging.getLogger(__name__)
+
+PASS = "PASS"
+FAIL = "FAIL"
+UNDECIDED = "UNDECIDED"
+
+FINAL_CODE_PATTERN = re.compile(r'FINAL_CODE:\s*(\d{4}\.\d{2}(?:\.\d{2})?)')
+QUOTED_LINE_PATTERNS = [
+    re.compile(r'Exact Tariff Line\**\s*:\s*\**\s*(.+)', re.IGNORECASE),
+    re.compile(r'Product Name\**\s*:\s*\**\s*(.+)', re.IGNORECASE),
+]
+# A quote only counts as the FINAL_CODE line when its description covers this share of the line's
+# description and is at least this long (or the whole description, when that is shorter)
+MIN_QUOTE_SHARE = 0.6
+MIN_QUOTE_CHARS = 12
+
+
+def normalize_text(text: str) -> str:
+    # Lowercase, drop the schedule's "- - -" indentation dashes, quotes and markdown, collapse whitespace
+    text = text.lower().replace("–", "-").replace("—", "-")
+    text = re.sub(r'[*`"\'\[\]]', ' ', text)
+    text = re.sub(r'(?:^|\s)-(?=\s)', ' ', text)
+    text = re.sub(r'[:;,.](?=\s|$)', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def code_in_evidence(code: str, evidence: str) -> bool:
+    # Exact dotted form first, then digits-only in case the evidence prints "85183010" or "8518 30 10"
+    if re.search(rf'(?<![\d.]){re.escape(code)}(?!\.?\d)', evidence):
+        return True
+    digits = code.replace(".", "")
+    pattern = r'[\s.]?'.join(re.escape(d) for d in (digits[:4], digits[4:6], digits[6:]) if d)
+    return re.search(rf'(?<!\d){pattern}(?!\.?\d)', evidence) is not None
+
+
+def quoted_lines(*texts) -> list:
+    lines = []
+    for text in texts:
+        for pattern in QUOTED_LINE_PATTERNS:
+            for match in pattern.finditer(text or ""):
+                line = match.group(1).strip().strip("[]").strip()
+                if line and "NOT FOUND IN EVIDENCE" not in line.upper():
+                    lines.append(line)
+    return lines
+
+
+def line_in_evidence(line: str, evidence: str) -> bool:
+    if line in evidence:
+        return True
+    return normalize_text(line) in normalize_text(evidence)
+
+
+def line_description(line: str) -> str:
+    # Description text of a tariff line: codes and the trailing unit / duty columns removed, normalized
+    text = CODE_PATTERN.sub(" ", line)
+    match = UNIT_PATTERN.search(text)
+    if match:
+        text = text[:match.start()]
+    return normalize_text(text)
+
+
+def quotes_line(quote: str, code_line: str) -> bool:
+    # The quote carries a real part of the evidence line's description, not a stray word like "u" or "Other"
+    quoted, described = line_description(quote), line_description(code_line)
+    if not quoted or not described or quoted not in described:
+        return False
+    return len(quoted) >= min(MIN_QUOTE_CHARS, len(described)) and len(quoted) >= MIN_QUOTE_SHARE * len(described)
+
+
+def verify_claims(final_output: str, worker_result: str, evidence: str):
+    # Mechanical check of the structured claims against the evidence. Returns (verdict, reason).
+    # FAIL/PASS are only returned when the answer is certain; anything fuzzy is left to the LLM judge.
+    if not evidence or not evidence.strip():
+        return UNDECIDED, "No evidence to check against."
+
+    code_match = FINAL_CODE_PATTERN.search(final_output or "")
+    if not code_match:
+        return UNDECIDED, "No FINAL_CODE line to check."
+    final_code = code_match.group(1)
+    if len(final_code) != 10:
+        # A 6-digit subheading never commits to a national tariff line; that is for the judge to weigh
+        return UNDECIDED, f"FINAL_CODE {final_code} is a subheading, not an 8-digit national tariff line."
+
+    if not code_in_evidence(final_code, evidence):
+        return FAIL, f"FINAL_CODE {final_code} does not appear in the retrieved evidence."
+
+    lines = quoted_lines(final_output, worker_result)
+    if not lines:
+        return UNDECIDED, f"FINAL_CODE {final_code} is in the evidence but no tariff line was quoted."
+
+    # The quoted line has to be the one for FINAL_CODE: it is in the evidence, carries the code, and
+    # quotes most of the description of the evidence line for that code
+    code_lines = [l for l in evidence.splitlines() if code_in_evidence(final_code, l)]
+    for line in lines:
+        if not line_in_evidence(line, evidence) or not code_in_evidence(final_code, line):
+            continue
+        if any(quotes_line(line, l) for l in code_lines):
+            return PASS, f"FINAL_CODE {final_code} and its quoted tariff line '{line[:80]}' found in evidence."
+    return UNDECIDED, f"FINAL_CODE {final_code} is in the evidence but no verbatim quote of its line was found."
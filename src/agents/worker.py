@@ -1,35 +1,23 @@
 import os
+import re
+import asyncio
 import logging
+import threading
 from dotenv import load_dotenv
-from src.tools.search_tool import query_stcced
+from src.tools.search_tool import search_stcced
+from src.agents.state import evidence_record
+from src.tools.lexical_index import reciprocal_rank_fusion
+from src.tools.evidence_packer import rerank_pool, pack_chunks, WORKER_EVIDENCE_TOKENS
+from src.tools.llm_calls import invoke_llm, ainvoke_llm
+from src.tools.model_cascade import model_tiers, get_model, run_cascade, arun_cascade
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Evidence is packed once, for the first (smallest) tier; escalated tiers read the same prompt
+model_name = model_tiers("worker")[0]
 
-RUN_MODE = os.getenv("RUN_MODE", "cloud")
-if RUN_MODE == "local":
-    model_name = os.getenv("LOCAL_WORKER_MODEL")
-    from langchain_ollama import ChatOllama
-    worker_llm = ChatOllama(model=model_name, base_url=os.getenv("OLLAMA_BASE_URL"))
-else:
-    model_name = os.getenv("CLOUD_WORKER_MODEL")
-    from langchain_google_genai import ChatGoogleGenerativeAI
-    worker_llm = ChatGoogleGenerativeAI(model=model_name, temperature=0.1)
-
-def worker_node(state: dict):
-    query_axis = state.get("query")
-    raw_evidence = query_stcced(query_axis)
-    
-    # Limit evidence length to avoid token overages
-    char_limit = 5000
-    if len(raw_evidence) > char_limit:
-        logger.warning(f"Evidence for {query_axis} truncated from {len(raw_evidence)} to {char_limit} chars.")
-        safe_evidence = raw_evidence[:char_limit] + "\n...[TRUNCATED FOR TOKEN LIMITS]..."
-    else:
-        safe_evidence = raw_evidence
-    
-    CLASSIFICATION_RULES = """CLASSIFICATION RULES:
+CLASSIFICATION_RULES = """CLASSIFICATION RULES:
 1. Identify the core product noun (e.g., 'wireless headphone' → core noun is 'headphone').
 2. ALWAYS prefer the code whose description EXPLICITLY NAMES the core product noun.
    Example: If you see '8518.30.10 - Headphones' AND '8518.30.59 - Other', PICK 8518.30.10 because it names 'Headphones'.
@@ -38,10 +26,66 @@ def worker_node(state: dict):
 5. Any codes found in the evidence are REAL tariff lines, not examples.
 6. NEVER paraphrase or summarize tariff text. Copy it EXACTLY, character for character."""
 
-    analysis_prompt = f"""
+# Retrievals allowed in flight at once across every audit in the process (embedding call + index scan each)
+RETRIEVAL_CONCURRENCY = int(os.getenv("RETRIEVAL_CONCURRENCY", "3"))
+_retrieval_slots = threading.BoundedSemaphore(max(1, RETRIEVAL_CONCURRENCY))
+
+def bounded_search(query: str) -> list:
+    with _retrieval_slots:
+        return search_stcced(query)
+
+def retrieval_update(state: dict, chunks: list) -> dict:
+    return {"retrievals": [{"attempt": state.get("attempt", 0), "query": state.get("query"), "chunks": chunks}]}
+
+# Retrieval-only workers: one per planned query, run in parallel by the graph. The analysis pass
+# (worker_node) runs once after all of them have written their results.
+def retrieval_node(state: dict):
+    return retrieval_update(state, bounded_search(state.get("query")))
+
+async def aretrieval_node(state: dict):
+    # Retrieval is blocking, so keep it off the event loop
+    return retrieval_update(state, await asyncio.to_thread(bounded_search, state.get("query")))
+
+def merge_retrievals(retrievals: list) -> list:
+    # One ranked, node-deduplicated list from the parallel retrievals. A chunk several queries found ranks higher.
+    if len(retrievals) == 1:
+        return list(retrievals[0]["chunks"])
+    texts = {}
+    for item in retrievals:
+        for node_id, text in item["chunks"]:
+            texts.setdefault(node_id, text)
+    fused = reciprocal_rank_fusion(
+        [[node_id for node_id, _ in item["chunks"]] for item in retrievals],
+        [1.0] * len(retrievals),
+    )
+    return [(node_id, texts[node_id]) for node_id, _ in fused]
+
+def gather_evidence(state: dict) -> list:
+    # Merge this round's retrievals, then on a retry rerank them together with the evidence already collected
+    # and pack the pool to the token budget instead of starting from scratch
+    retrievals = state.get("retrievals") or []
+    fresh = merge_retrievals(retrievals) if retrievals else []
+    fresh_ids = {node_id for node_id, _ in fresh}
+    prior = [(k, v) for k, v in (state.get("evidence") or {}).get("chunks", {}).items() if k not in fresh_ids]
+    ranked = fresh
+    if prior:
+        queries = " ".join(item["query"] for item in retrievals)
+        ranked = rerank_pool(f"{state.get('query', '')} {queries}", fresh, prior)
+        logger.info(f"Worker: merged {len(fresh)} new and {len(prior)} prior chunks into a pool of {len(ranked)}.")
+    elif len(retrievals) > 1:
+        total = sum(len(item["chunks"]) for item in retrievals)
+        logger.info(f"Worker: merged {len(retrievals)} parallel retrievals ({total} chunks) into {len(fresh)} unique chunks.")
+    return pack_chunks(ranked, WORKER_EVIDENCE_TOKENS, model_name, label="worker")
+
+def join_chunks(chunks: list) -> str:
+    return "\n---\n".join(text for _, text in chunks) if chunks else "No relevant documents found."
+
+def build_analysis_prompt(product: str, queries: list, safe_evidence: str) -> str:
+    return f"""
     You are a Tariff Classification Expert. Your job is to find the correct HS code from the evidence below.
     
-    PRODUCT TO CLASSIFY: {query_axis}
+    PRODUCT TO CLASSIFY: {product}
+    SEARCHES RUN: {"; ".join(queries)}
     
     RAW EVIDENCE FROM TARIFF SCHEDULE:
     {safe_evidence}
@@ -62,11 +106,42 @@ def worker_node(state: dict):
     
     IMPORTANT: The "Exact Tariff Line" MUST be copied from the evidence verbatim. If you cannot find it, say "NOT FOUND IN EVIDENCE".
     """
-    
-    response = worker_llm.invoke(analysis_prompt)
-    
-    # Extract token usage from response metadata if available
-    usage = getattr(response, "usage_metadata", None) or {}
-    tokens = usage.get("total_tokens", 0)
-    
-    return {"worker_results": [f"Findings for {query_axis}:\n{response.content}"], "total_tokens": tokens, "retrieval_context": [safe_evidence, CLASSIFICATION_RULES]}
\ No newline at end of file
+
+def analysis_accepted(chunks: list):
+    # supervisor_review_node's deterministic check, applied before a tier's answer is kept: a cited 8-digit code
+    # must be in the evidence. When the evidence holds no 8-digit line at all a larger model can't do better.
+    evidence_codes = set(re.findall(r'\b(\d{4}\.\d{2}\.\d{2})\b', join_chunks(chunks)))
+
+    def accept(response) -> bool:
+        if not evidence_codes:
+            return True
+        return any(code in evidence_codes for code in re.findall(r'\b(\d{4}\.\d{2}\.\d{2})\b', response.content))
+    return accept
+
+def analysis_update(state: dict, chunks: list, response, tier: dict) -> dict:
+    # Token usage is added to total_tokens by the node's tracing wrapper (src/tools/tracing.py)
+    retrievals = state.get("retrievals") or []
+    query_axis = " | ".join(item["query"] for item in retrievals) or state.get("query")
+    attempt = retrievals[0]["attempt"] if retrievals else state.get("step_count", 0)
+    analysis = f"Findings for {query_axis}:\n{response.content}"
+    codes = sorted(set(re.findall(r'\b\d{4}\.\d{2}(?:\.\d{2})?\b', join_chunks(chunks))))
+
+    # The static CLASSIFICATION_RULES stay out of state; only this attempt's evidence record goes in
+    record = evidence_record(attempt, query_axis, chunks, analysis, codes)
+    return {"evidence": record, "model_tiers": {"worker": tier}}
+
+def analysis_prompt(state: dict, chunks: list) -> str:
+    queries = [item["query"] for item in state.get("retrievals") or []]
+    return build_analysis_prompt(state.get("query"), queries, join_chunks(chunks))
+
+def worker_node(state: dict):
+    chunks = gather_evidence(state)
+    prompt = analysis_prompt(state, chunks)
+    response, tier = run_cascade("worker", lambda t: invoke_llm(get_model("worker", t), prompt), analysis_accepted(chunks))
+    return analysis_update(state, chunks, response, tier)
+
+async def aworker_node(state: dict):
+    chunks = await asyncio.to_thread(gather_evidence, state)
+    prompt = analysis_prompt(state, chunks)
+    response, tier = await arun_cascade("worker", lambda t: ainvoke_llm(get_model("worker", t), prompt), analysis_accepted(chunks))
+    return analysis_update(state, chunks, response, tier)
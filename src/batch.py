@@ -0,0 +1,150 @@
+import os
+import re
+import csv
+import json
+import time
+import asyncio
+import logging
+
+from src.graph.builder import arun_audit, aresume_audit, apending_nodes
+
+logger = logging.getLogger(__name__)
+
+QUERY_FIELDS = ("query", "product", "description", "name")
+ID_FIELDS = ("id", "sku", "item_id")
+
+
+def load_products(path: str) -> list:
+    # Accepts CSV with a header row or JSONL. Returns [{"id": ..., "query": ...}].
+    if path.endswith(".jsonl"):
+        with open(path, "r") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, "r", newline="") as f:
+            rows = list(csv.DictReader(f))
+
+    # Ids name each item's checkpoint thread and its output record, so they must be unique. Rows without
+    # one are named by position (stable across resumed runs of the same file), never by their product text.
+    products, seen = [], set()
+    for i, row in enumerate(rows):
+        query = next((row[k] for k in QUERY_FIELDS if row.get(k)), None)
+        if not query:
+            logger.warning(f"Batch: row {i + 1} has no product text, skipping.")
+            continue
+        item_id = next((str(row[k]) for k in ID_FIELDS if row.get(k)), f"row{i + 1}")
+        if item_id in seen:
+            logger.warning(f"Batch: row {i + 1} repeats id {item_id}, using {item_id}-row{i + 1}.")
+            item_id = f"{item_id}-row{i + 1}"
+        seen.add(item_id)
+        products.append({"id": item_id, "query": query})
+    return products
+
+
+def completed_ids(output_path: str) -> set:
+    # Items already classified by a previous (possibly interrupted) run
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            # Failed items are retried on resume
+            if "error" not in record and "id" in record:
+                done.add(record["id"])
+    return done
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize_final_state(final_state: dict) -> dict:
+    final_output = final_state.get("final_hscode", "") or ""
+    code_match = re.search(r'FINAL_CODE:\s*(\d{4}\.\d{2}(?:\.\d{2})?)', final_output)
+    return {
+        "hscode": code_match.group(1) if code_match else None,
+        "confidence": final_state.get("final_confidence"),
+        "faithfulness": final_state.get("faithfulness_score", 0.0),
+        "status": final_state.get("status"),
+        "tokens": final_state.get("total_tokens", 0),
+        "cache_hit": final_state.get("cache_hit", False),
+        # Cascade tier (0 = smallest model) that produced each node's final answer
+        "tiers": {node: record["tier"] for node, record in (final_state.get("model_tiers") or {}).items()},
+    }
+
+
+async def classify_item(item: dict, limit: asyncio.Semaphore, use_cache: bool = True) -> dict:
+    async with limit:
+        start = time.perf_counter()
+        record = {"id": item["id"], "query": item["query"]}
+        try:
+            thread_id = f"batch_{item['id']}"
+            # An item interrupted by a crash picks up from its last checkpoint instead of starting over
+            if await apending_nodes(thread_id):
+                final_state = await aresume_audit(thread_id)
+                record["resumed"] = True
+            else:
+                final_state = await arun_audit(item["query"], thread_id, use_cache=use_cache)
+            record.update(summarize_final_state(final_state))
+        except Exception as e:
+            logger.error(f"Batch: item {item['id']} failed: {e}")
+            record["error"] = str(e)
+        record["latency"] = round(time.perf_counter() - start, 3)
+        return record
+
+
+async def arun_batch(input_path: str, output_path: str, concurrency: int = 4, use_cache: bool = True) -> dict:
+    # All audits share one event loop; the semaphore bounds how many are in flight
+    products = load_products(input_path)
+    done = completed_ids(output_path)
+    pending = [p for p in products if p["id"] not in done]
+    logger.info(f"Batch: {len(products)} items, {len(done)} already done, {len(pending)} to classify with concurrency={concurrency}.")
+
+    limit = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+    start = time.perf_counter()
+    with open(output_path, "a") as out:
+        tasks = [asyncio.create_task(classify_item(item, limit, use_cache)) for item in pending]
+        for n, task in enumerate(asyncio.as_completed(tasks), 1):
+            record = await task
+            # Results are streamed as they finish so an interrupted batch can resume
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            if "error" in record:
+                failures += 1
+            else:
+                latencies.append(record["latency"])
+            logger.info(f"Batch: [{n}/{len(pending)}] {record['id']} -> {record.get('hscode')} ({record['latency']:.2f}s)")
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "items": len(pending),
+        "skipped": len(done),
+        "failed": failures,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_per_min": round(len(pending) / elapsed * 60, 2) if elapsed else 0.0,
+        "p50_latency_s": round(percentile(latencies, 50), 2),
+        "p95_latency_s": round(percentile(latencies, 95), 2),
+    }
+    print(f"""
+BATCH REPORT
+------------------------------------
+ITEMS: {summary['items']} (skipped {summary['skipped']} already done, {summary['failed']} failed)
+ELAPSED: {summary['elapsed_s']:.2f}s
+THROUGHPUT: {summary['throughput_per_min']:.2f} items/min
+LATENCY: p50 {summary['p50_latency_s']:.2f}s / p95 {summary['p95_latency_s']:.2f}s
+------------------------------------
+""")
+    return summary
+
+
+def run_batch(input_path: str, output_path: str, concurrency: int = 4, use_cache: bool = True) -> dict:
+    return asyncio.run(arun_batch(input_path, output_path, concurrency, use_cache))
@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Offline benchmark: the full graph against a golden product -> HS code set, with deterministic stand-ins
+# for every chat model and the embedder (src/tools/stand_ins.py) over a small index built from
+# benchmarks/tariff_sample.txt. Needs no network, GPU or API quota.
+#
+#   python src/benchmark.py                        # run and compare against benchmarks/baseline.json
+#   python src/benchmark.py --save-baseline        # run and record the result as the new baseline
+
+GOLDEN_PATH = "benchmarks/golden.jsonl"
+SAMPLE_PATH = "benchmarks/tariff_sample.txt"
+BASELINE_PATH = "benchmarks/baseline.json"
+
+# Relative increase in latency/tokens/LLM calls tolerated before a metric counts as a regression
+DEFAULT_TOLERANCE = 0.25
+# Metrics where higher is better; all other compared metrics are better when lower
+HIGHER_IS_BETTER = {"accuracy", "throughput_per_min"}
+COMPARED_METRICS = ("accuracy", "p50_latency_s", "p95_latency_s", "throughput_per_min", "mean_attempts", "llm_calls", "tokens")
+
+
+def isolate_environment(work_dir: str, llm_cache: bool = False) -> str:
+    # Must run before any src.* import: module-level config (storage paths, cache switches, model choice) reads it.
+    # Local mode keeps model construction offline; the stand-ins replace those clients before any call is made.
+    # Returns the storage dir for the sample index.
+    storage_dir = os.path.join(work_dir, "storage")
+    os.environ["STORAGE_DIR"] = storage_dir
+    os.environ["RUN_MODE"] = "local"
+    os.environ["RETRIEVAL_CACHE"] = "off"
+    os.environ["CLASSIFICATION_CACHE"] = "off"
+    # Beside the index, not in it: the index handle watches every file under STORAGE_DIR and would reload
+    # the index on each checkpoint write
+    os.environ["CHECKPOINT_DB"] = os.path.join(work_dir, "checkpoints.sqlite")
+    # The LLM response cache is the one cache worth measuring across runs: a replayed benchmark should be all hits
+    os.environ["LLM_CACHE"] = "on" if llm_cache else "off"
+    for key in ("LOCAL_WORKER_MODEL", "LOCAL_GROQ_MODEL", "EMBEDED_MODEL"):
+        os.environ[key] = "stand-in"
+    os.environ.setdefault("OLLAMA_BASE_URL", "http://localhost:11434")
+    return storage_dir
+
+
+def install_stand_ins(latency_ms: float):
+    from src.ingestion.llama_settings import set_embed_model
+    from src.tools.model_cascade import set_model_factory
+    from src.tools.stand_ins import StandInChatModel, HashEmbedding
+
+    set_embed_model(HashEmbedding(model_name="hash-embedding"))
+    # Every role and cascade tier gets its own stand-in, named after the role it plays
+    set_model_factory(lambda role, name: StandInChatModel(f"stand-in-{role}", latency_ms))
+
+
+def build_sample_index(sample_path: str, storage_dir: str):
+    from llama_index.core import Document, VectorStoreIndex
+    from src.ingestion.parse import split_nodes, build_code_table, build_lexical_index, build_heading_index
+    from src.tools.vector_store import new_storage_context
+
+    with open(sample_path, "r") as f:
+        documents = [Document(text=f.read(), metadata={"page_label": "1"}, id_=os.path.basename(sample_path))]
+    nodes = split_nodes(documents)
+    index = VectorStoreIndex(nodes, storage_context=new_storage_context())
+    index.storage_context.persist(persist_dir=storage_dir)
+    build_code_table(documents)
+    build_lexical_index(index)
+    build_heading_index(index)
+    return index
+
+
+def load_golden(path: str) -> list:
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def measure_item(item: dict, final_state: dict, trace, latency: float) -> dict:
+    from src.batch import summarize_final_state
+
+    record = {"id": item["id"], "query": item["query"], "expected": item["expected"]}
+    record.update(summarize_final_state(final_state))
+    kinds = trace.kind_summary()
+    record.update({
+        # expected is null for products the schedule extract doesn't cover; an optional "status" also pins the
+        # audit outcome (REVISE for items whose audit has to fail every attempt)
+        "correct": record["hscode"] == item["expected"] and item.get("status", record["status"]) == record["status"],
+        "latency": round(latency, 4),
+        # step_count counts every extra round (pacer retries and heading expansions)
+        "attempts": final_state.get("step_count", 0) + 1,
+        "llm_calls": kinds.get("llm", {}).get("calls", 0),
+        "llm_cache_hits": kinds.get("llm", {}).get("cache_hits", 0),
+        "retrievals": kinds.get("retrieval", {}).get("calls", 0),
+    })
+    return record
+
+
+def run_sequential(golden: list) -> list:
+    from src.graph.builder import run_audit
+    from src.tools.tracing import trace_run
+
+    records = []
+    for item in golden:
+        start = time.perf_counter()
+        with trace_run(item["id"], item["query"]) as trace:
+            final_state = run_audit(item["query"], f"bench_{item['id']}", use_cache=False)
+        records.append(measure_item(item, final_state, trace, time.perf_counter() - start))
+    return records
+
+
+async def run_concurrent(golden: list, concurrency: int) -> list:
+    from src.graph.builder import arun_audit
+    from src.tools.tracing import trace_run
+
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(item):
+        async with limit:
+            start = time.perf_counter()
+            with trace_run(item["id"], item["query"]) as trace:
+                final_state = await arun_audit(item["query"], f"bench_{item['id']}", use_cache=False)
+            return measure_item(item, final_state, trace, time.perf_counter() - start)
+
+    return await asyncio.gather(*(one(item) for item in golden))
+
+
+def summarize(records: list, elapsed: float) -> dict:
+    from src.batch import percentile
+    from src.tools.llm_calls import get_llm_cache
+
+    latencies = [r["latency"] for r in records]
+    summary = {
+        "items": len(records),
+        "accuracy": round(sum(r["correct"] for r in records) / len(records), 4) if records else 0.0,
+        "p50_latency_s": round(percentile(latencies, 50), 4),
+        "p95_latency_s": round(percentile(latencies, 95), 4),
+        "throughput_per_min": round(len(records) / elapsed * 60, 2) if elapsed else 0.0,
+        "mean_attempts": round(sum(r["attempts"] for r in records) / len(records), 3) if records else 0.0,
+        "llm_calls": sum(r["llm_calls"] for r in records),
+        "tokens": sum(r["tokens"] for r in records),
+        # Items where any node needed more than its first model tier
+        "escalated": sum(1 for r in records if any(r.get("tiers", {}).values())),
+        "elapsed_s": round(elapsed, 3),
+    }
+    llm_cache = get_llm_cache()
+    if llm_cache is not None:
+        stats = llm_cache.stats()
+        summary.update({"llm_cache_hits": stats["hits"], "llm_cache_misses": stats["misses"], "llm_cache_saved_tokens": stats["saved_tokens"]})
+    return summary
+
+
+def compare(summary: dict, baseline: dict, tolerance: float) -> list:
+    # Returns [(metric, baseline, current, regressed)]
+    rows = []
+    for metric in COMPARED_METRICS:
+        if metric not in baseline:
+            continue
+        old, new = baseline[metric], summary[metric]
+        if metric == "accuracy":
+            regressed = new < old
+        elif metric in HIGHER_IS_BETTER:
+            regressed = new < old * (1 - tolerance)
+        else:
+            regressed = new > old * (1 + tolerance) and new - old > 1e-3
+        rows.append((metric, old, new, regressed))
+    return rows
+
+
+def print_report(records: list, summary: dict, comparison: list):
+    lines = ["", "OFFLINE BENCHMARK", "------------------------------------",
+             f"{'ID':<6}{'EXPECTED':<13}{'GOT':<13}{'OK':<4}{'SECONDS':>9}{'ATTEMPTS':>10}{'LLM':>5}{'TOKENS':>8}"]
+    for r in records:
+        lines.append(f"{r['id']:<6}{str(r['expected']):<13}{str(r['hscode']):<13}{'y' if r['correct'] else 'n':<4}"
+                     f"{r['latency']:>9.3f}{r['attempts']:>10}{r['llm_calls']:>5}{r['tokens']:>8}")
+    lines.append("------------------------------------")
+    lines.extend(f"{k}: {v}" for k, v in summary.items())
+    if comparison:
+        lines.append("------------------------------------")
+        lines.append(f"{'METRIC':<22}{'BASELINE':>12}{'CURRENT':>12}")
+        for metric, old, new, regressed in comparison:
+            lines.append(f"{metric:<22}{old:>12}{new:>12}{'  REGRESSION' if regressed else ''}")
+    lines.append("------------------------------------")
+    print("\n".join(lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark with stand-in models and a golden product set")
+    parser.add_argument("--golden", default=GOLDEN_PATH, help="JSONL of {id, query, expected[, status]}")
+    parser.add_argument("--sample", default=SAMPLE_PATH, help="Tariff schedule extract the benchmark index is built from")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline summary to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Write this run's summary as the new baseline")
+    parser.add_argument("--output", help="Write per-query records and the summary to this JSON file")
+    parser.add_argument("--concurrency", type=int, default=1, help="Audits in flight at once (>1 uses the async graph)")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Simulated latency of each stand-in model call")
+    parser.add_argument("--llm-cache", action="store_true", help="Use the on-disk LLM response cache (a second run replays from it)")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Relative slack before latency/token metrics count as regressions")
+    args = parser.parse_args()
+
+    # Without a baseline nothing can regress, so a compare run would always pass; refuse it instead
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}. Record one with --save-baseline first.", file=sys.stderr)
+        return 2
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    storage_dir = isolate_environment(tempfile.mkdtemp(prefix="hs_bench_"), llm_cache=args.llm_cache)
+    install_stand_ins(args.llm_latency_ms)
+
+    from src.tools.search_tool import index_handle
+    index_handle.warm(build_sample_index(args.sample, storage_dir))
+
+    golden = load_golden(args.golden)
+    start = time.perf_counter()
+    if args.concurrency > 1:
+        records = asyncio.run(run_concurrent(golden, args.concurrency))
+    else:
+        records = run_sequential(golden)
+    summary = summarize(records, time.perf_counter() - start)
+
+    comparison = []
+    if not args.save_baseline:
+        with open(args.baseline, "r") as f:
+            comparison = compare(summary, json.load(f), args.tolerance)
+    print_report(records, summary, comparison)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "records": records}, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    return 1 if any(regressed for *_, regressed in comparison) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import os
+
+# Where the index and its companion files (code table, BM25 index, heading centroids, manifest) are persisted.
+# Read in one place so ingestion and retrieval always agree on it.
+STORAGE_DIR = os.getenv("STORAGE_DIR", "./storage")
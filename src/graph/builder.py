@@ -1,26 +1,40 @@
 import os
-import time
+import asyncio
 import logging
-from langgraph.graph import StateGraph, START, END
+import sqlite3
+import threading
 
 from src.agents.state import AuditorState
-from src.agents.supervisor import supervisor_node, aggregator_node, route_to_workers, supervisor_review_node, supervisor_review_router, supervisor_post_aggregator_node, supervisor_post_aggregator_router
-from src.agents.auditor import auditor_node 
-from src.agents.worker import worker_node
+from src.tools.rate_limiter import get_rate_limiter
+from src.tools.search_tool import index_handle, embed_query
+from src.tools.classification_cache import ClassificationCache
+from src.tools.tracing import traced_node, span
+from src.tools import startup
 
 logger = logging.getLogger(__name__)
 RUN_MODE = os.getenv("RUN_MODE", "cloud")
+# State is checkpointed after every graph step so an interrupted audit can resume (--resume <thread>)
+CHECKPOINTS_ENABLED = os.getenv("CHECKPOINTS", "on").lower() not in ("0", "off", "false")
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", "./cache/checkpoints.sqlite")
 
-def pacer_node(state: AuditorState):
-    # Encounter too many rate-limit so have to put it here. This is a safety node to prevent errors during recursive loops.
+def log_pacing():
+    # Rate limits are enforced per call by the shared provider limiters (src/tools/rate_limiter.py),
+    # which wait only as long as the quota requires. The pacer just reports the current back-pressure.
     if RUN_MODE != "local":
-        logger.info("Pacing: Waiting 10 seconds to respect API rate limits...")
-        time.sleep(10)
+        wait = get_rate_limiter("groq").pending_wait()
+        logger.info(f"Pacing: next Groq call available in {wait:.2f}s.")
     else:
         logger.info("Local mode: skipping cooldown.")
-    
-    current_count = state.get("step_count", 0)
-    return {**state, "step_count": current_count + 1}
+
+def pacer_node(state: AuditorState):
+    # step_count has an additive reducer, so return only the increment. Echoing the whole state back
+    # would re-append every list field and double the counter on each loop.
+    log_pacing()
+    return {"step_count": 1}
+
+async def apacer_node(state: AuditorState):
+    log_pacing()
+    return {"step_count": 1}
 
 def router(state: AuditorState):
     # Set up the depth of the recursive loop and the exit condition based on the Auditor's feedback
@@ -34,47 +48,233 @@ def router(state: AuditorState):
     logger.info("FINALIZING: Audit complete.")
     return "end"
 
-# Set up the graph workflow
-workflow = StateGraph(AuditorState)
-workflow.add_node("supervisor", supervisor_node)
-workflow.add_node("worker_node", worker_node)
-workflow.add_node("supervisor_review", supervisor_review_node)
-workflow.add_node("aggregator", aggregator_node)
-workflow.add_node("supervisor_post_aggregator", supervisor_post_aggregator_node)
-workflow.add_node("auditor", auditor_node)
-workflow.add_node("pacer", pacer_node)
-workflow.add_edge(START, "supervisor")
-workflow.add_conditional_edges("supervisor", route_to_workers)
-workflow.add_edge("worker_node", "supervisor_review")
-
-workflow.add_conditional_edges(
-    "supervisor_review",
-    supervisor_review_router,
-    {
-        "aggregator": "aggregator",
-        "pacer": "pacer"
+def build_graph(use_async: bool = False, checkpointer=None):
+    # Set up the graph workflow. The async variant swaps in nodes that await their LLM/DeepEval calls,
+    # so many audits can share one event loop; the routing is identical.
+    # LangGraph and the agent modules load here, on the first audit, not when this module is imported.
+    from langgraph.graph import StateGraph, START, END
+    from src.agents.supervisor import supervisor_node, aggregator_node, route_to_workers, supervisor_review_node, supervisor_review_router, supervisor_post_aggregator_node, supervisor_post_aggregator_router
+    from src.agents.supervisor import asupervisor_node, aaggregator_node, route_after_pacer
+    from src.agents.auditor import auditor_node, aauditor_node
+    from src.agents.worker import worker_node, aworker_node, retrieval_node, aretrieval_node
+
+    workflow = StateGraph(AuditorState)
+    nodes = {
+        "supervisor": asupervisor_node if use_async else supervisor_node,
+        "retriever": aretrieval_node if use_async else retrieval_node,
+        "worker_node": aworker_node if use_async else worker_node,
+        "supervisor_review": supervisor_review_node,
+        "aggregator": aaggregator_node if use_async else aggregator_node,
+        "supervisor_post_aggregator": supervisor_post_aggregator_node,
+        "auditor": aauditor_node if use_async else auditor_node,
+        "pacer": apacer_node if use_async else pacer_node,
     }
-)
+    # Every node records a span and reports the tokens of the LLM calls it made as its total_tokens increment
+    for name, node in nodes.items():
+        workflow.add_node(name, traced_node(name, node))
+    workflow.add_edge(START, "supervisor")
+    workflow.add_conditional_edges("supervisor", route_to_workers)
+    # Parallel retrievers fan back in to a single analysis pass over their merged evidence
+    workflow.add_edge("retriever", "worker_node")
+    workflow.add_edge("worker_node", "supervisor_review")
 
-workflow.add_edge("aggregator", "supervisor_post_aggregator")
+    workflow.add_conditional_edges(
+        "supervisor_review",
+        supervisor_review_router,
+        {
+            "aggregator": "aggregator",
+            "pacer": "pacer"
+        }
+    )
 
-workflow.add_conditional_edges(
-    "supervisor_post_aggregator",
-    supervisor_post_aggregator_router,
-    {
-        "auditor": "auditor",
-        "pacer": "pacer"
-    }
-)
-
-workflow.add_conditional_edges(
-    "auditor",
-    router,
-    {
-        "pacer": "pacer",
-        "end": END
+    workflow.add_edge("aggregator", "supervisor_post_aggregator")
+
+    workflow.add_conditional_edges(
+        "supervisor_post_aggregator",
+        supervisor_post_aggregator_router,
+        {
+            "auditor": "auditor",
+            "pacer": "pacer"
+        }
+    )
+
+    workflow.add_conditional_edges(
+        "auditor",
+        router,
+        {
+            "pacer": "pacer",
+            "end": END
+        }
+    )
+
+    # Retries with a specific critique go straight to a retriever; others are re-planned by the supervisor
+    workflow.add_conditional_edges("pacer", route_after_pacer, {"supervisor": "supervisor"})
+    return workflow.compile(checkpointer=checkpointer)
+
+def sqlite_checkpointer():
+    if not CHECKPOINTS_ENABLED:
+        return None
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    os.makedirs(os.path.dirname(CHECKPOINT_DB) or ".", exist_ok=True)
+    return SqliteSaver(sqlite3.connect(CHECKPOINT_DB, check_same_thread=False))
+
+_graph = None
+_graph_lock = threading.Lock()
+
+def get_graph():
+    # The sync graph, compiled on first use and shared by every thread
+    global _graph
+    with _graph_lock:
+        if _graph is None:
+            with startup.phase("compile graph (+ agent imports)"):
+                _graph = build_graph(checkpointer=sqlite_checkpointer())
+        return _graph
+
+_async_graph = None
+_async_graph_loop = None
+_async_graph_lock = None
+_async_graph_lock_loop = None
+
+def async_graph_lock(loop) -> asyncio.Lock:
+    # An asyncio.Lock is bound to the loop it is first used on, so each loop gets its own
+    global _async_graph_lock, _async_graph_lock_loop
+    if _async_graph_lock is None or _async_graph_lock_loop is not loop:
+        _async_graph_lock = asyncio.Lock()
+        _async_graph_lock_loop = loop
+    return _async_graph_lock
+
+async def get_async_graph():
+    # aiosqlite connections belong to the event loop that opened them, so the async graph (and its
+    # checkpointer) is compiled on first use inside the running loop, once per loop. Concurrent first
+    # callers (batch tasks, MCP calls) wait on the lock and share the one graph and connection.
+    global _async_graph, _async_graph_loop
+    loop = asyncio.get_running_loop()
+    async with async_graph_lock(loop):
+        if _async_graph is None or _async_graph_loop is not loop:
+            checkpointer = None
+            if CHECKPOINTS_ENABLED:
+                import aiosqlite
+                from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+                os.makedirs(os.path.dirname(CHECKPOINT_DB) or ".", exist_ok=True)
+                checkpointer = AsyncSqliteSaver(await aiosqlite.connect(CHECKPOINT_DB))
+            _async_graph = build_graph(use_async=True, checkpointer=checkpointer)
+            _async_graph_loop = loop
+        return _async_graph
+
+def initial_audit_state(query: str) -> dict:
+    return {
+        "query": query,
+        "step_count": 0,
+        "evidence": {"records": [], "chunks": {}},
+        "retrievals": []
     }
-)
 
-workflow.add_edge("pacer", "supervisor")
-graph = workflow.compile()
\ No newline at end of file
+_classification_cache = None
+_classification_cache_lock = threading.Lock()
+
+def get_classification_cache():
+    # Opt-in (CLASSIFICATION_CACHE=on, or --classification-cache on the CLI): a semantic hit serves a cached code
+    # without any audit, and near-identical descriptions can still belong under different headings.
+    # Read at call time so the CLI flag can turn it on.
+    global _classification_cache
+    if os.getenv("CLASSIFICATION_CACHE", "off").lower() not in ("1", "on", "true"):
+        return None
+    with _classification_cache_lock:
+        if _classification_cache is None:
+            _classification_cache = ClassificationCache()
+        return _classification_cache
+
+def cache_lookup(query: str, use_cache: bool = True):
+    # Returns (cached_final_state or None, query embedding or None). The embedding is reused to store the result.
+    cache = get_classification_cache()
+    if cache is None:
+        return None, None
+    cache.set_index_version(index_handle.version)
+    embedding = embed_query(query)
+    if not use_cache:
+        return None, embedding
+    with span("cache", "classification") as record:
+        hit = cache.lookup(embedding)
+        record["cache_hit"] = hit is not None
+    if hit is None:
+        return None, embedding
+    cached_state, similarity, cached_query = hit
+    logger.info(f"CACHE HIT: '{query}' matched cached '{cached_query}' (similarity {similarity:.3f}). Skipping graph.")
+    return {**cached_state, "query": query, "cache_hit": True, "step_count": 0, "total_tokens": 0}, embedding
+
+def cache_store(query: str, embedding, final_state: dict):
+    cache = get_classification_cache()
+    if cache is not None and embedding is not None:
+        cache.store(query, embedding, final_state)
+
+def audit_config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": f"audit_{thread_id}"}}
+
+async def apending_nodes(thread_id: str) -> tuple:
+    # Nodes an interrupted run of this thread would execute next; empty when there is nothing to resume
+    if not CHECKPOINTS_ENABLED:
+        return ()
+    compiled = await get_async_graph()
+    return (await compiled.aget_state(audit_config(thread_id))).next
+
+def resume_audit(thread_id: str):
+    # Continue a checkpointed run from the last completed step. A run that already finished returns its final state.
+    if not CHECKPOINTS_ENABLED:
+        raise ValueError("Checkpointing is disabled (CHECKPOINTS=off); nothing to resume.")
+    graph = get_graph()
+    config = audit_config(thread_id)
+    snapshot = graph.get_state(config)
+    if not snapshot.values:
+        raise ValueError(f"No checkpoint found for thread '{thread_id}'.")
+    if not snapshot.next:
+        logger.info(f"Thread '{thread_id}' already finished; returning its final state.")
+        return snapshot.values
+    logger.info(f"Resuming thread '{thread_id}' at {list(snapshot.next)} (step {snapshot.values.get('step_count', 0)}).")
+    final_state = graph.invoke(None, config=config)
+    _, embedding = cache_lookup(final_state["query"], use_cache=False)
+    cache_store(final_state["query"], embedding, final_state)
+    return final_state
+
+async def aresume_audit(thread_id: str):
+    if not CHECKPOINTS_ENABLED:
+        raise ValueError("Checkpointing is disabled (CHECKPOINTS=off); nothing to resume.")
+    compiled = await get_async_graph()
+    config = audit_config(thread_id)
+    snapshot = await compiled.aget_state(config)
+    if not snapshot.values:
+        raise ValueError(f"No checkpoint found for thread '{thread_id}'.")
+    if not snapshot.next:
+        return snapshot.values
+    logger.info(f"Resuming thread '{thread_id}' at {list(snapshot.next)} (step {snapshot.values.get('step_count', 0)}).")
+    final_state = await compiled.ainvoke(None, config=config)
+    _, embedding = await asyncio.to_thread(cache_lookup, final_state["query"], False)
+    await asyncio.to_thread(cache_store, final_state["query"], embedding, final_state)
+    return final_state
+
+def run_audit(query: str, thread_id: str, use_cache: bool = True):
+    # One full audit on the shared compiled graph. Safe to call from several threads at once.
+    # use_cache=False bypasses the lookup but still records an APPROVED result.
+    cached, embedding = cache_lookup(query, use_cache)
+    if cached is not None:
+        return cached
+    graph = get_graph()
+    config = audit_config(thread_id)
+    if graph.checkpointer is not None:
+        # A fresh run must not fold into an earlier run's checkpointed state through the reducers
+        graph.checkpointer.delete_thread(config["configurable"]["thread_id"])
+    final_state = graph.invoke(initial_audit_state(query), config=config)
+    cache_store(query, embedding, final_state)
+    return final_state
+
+async def arun_audit(query: str, thread_id: str, use_cache: bool = True):
+    # Async counterpart of run_audit; many of these can be awaited concurrently on one loop
+    cached, embedding = await asyncio.to_thread(cache_lookup, query, use_cache)
+    if cached is not None:
+        return cached
+    compiled = await get_async_graph()
+    config = audit_config(thread_id)
+    if compiled.checkpointer is not None:
+        await compiled.checkpointer.adelete_thread(config["configurable"]["thread_id"])
+    final_state = await compiled.ainvoke(initial_audit_state(query), config=config)
+    await asyncio.to_thread(cache_store, query, embedding, final_state)
+    return final_state
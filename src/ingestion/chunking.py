@@ -0,0 +1,116 @@
+import os
+import logging
+from llama_index.core import Document
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import TextNode
+
+from src.ingestion.hs_codes import scan_lines
+
+logger = logging.getLogger(__name__)
+
+# Blocks longer than this (e.g. headings with dozens of national lines) are split, each part keeping the header
+MAX_BLOCK_CHARS = int(os.getenv("TARIFF_BLOCK_MAX_CHARS", "2000"))
+# Pages of notes shorter than this are dropped rather than embedded as near-empty chunks
+MIN_NOTES_CHARS = 200
+# Page label and unit are useful metadata for display, but only noise in the embedding text
+EXCLUDED_EMBED_KEYS = ["page_label", "unit", "file_name", "file_path", "file_type", "file_size", "creation_date", "last_modified_date"]
+
+
+def without_positional_metadata(documents):
+    # Page label and file details change whenever the PDF is repaginated or moved. Kept out of the embed text,
+    # they no longer change the content id (and so the embedding) of text that did not change.
+    for doc in documents:
+        doc.excluded_embed_metadata_keys = sorted(set(doc.excluded_embed_metadata_keys) | set(EXCLUDED_EMBED_KEYS))
+    return documents
+
+
+class _Block:
+    def __init__(self, code: str, heading: str, heading_desc: str, page_label: str):
+        self.code = code
+        self.heading = heading
+        self.heading_desc = heading_desc
+        self.page_label = page_label
+        self.description = ""
+        self.units = []
+        self.rows = []
+
+    def add(self, row: dict):
+        if row["code"] == self.code:
+            self.description = row["description"]
+        if row["unit"] and row["unit"] not in self.units:
+            self.units.append(row["unit"])
+        self.rows.append(row["text"])
+
+    def to_nodes(self) -> list:
+        header = f"Heading {self.heading}: {self.heading_desc}" if self.heading_desc else f"Heading {self.heading}"
+        parts, current = [], []
+        for text in self.rows:
+            if current and sum(len(t) for t in current) + len(text) > MAX_BLOCK_CHARS:
+                parts.append(current)
+                current = []
+            current.append(text)
+        if current:
+            parts.append(current)
+
+        metadata = {
+            "code": self.code,
+            "description": self.description or self.heading_desc,
+            "unit": ", ".join(self.units),
+            "chapter": self.heading[:2],
+            "heading": self.heading,
+            "page_label": self.page_label,
+        }
+        return [
+            TextNode(
+                text="\n".join([header] + rows),
+                metadata=dict(metadata),
+                excluded_embed_metadata_keys=EXCLUDED_EMBED_KEYS,
+                excluded_llm_metadata_keys=EXCLUDED_EMBED_KEYS,
+            )
+            for rows in parts
+        ]
+
+
+def tariff_nodes_from_documents(documents) -> list:
+    # One node per subheading block (the 6-digit row plus its 8-digit lines), or per heading when it has no
+    # subheadings. Blocks continue across page breaks. Non-tariff text (section/chapter notes) is sentence-split.
+    nodes, notes = [], []
+    block = None
+    heading, heading_desc = "", ""
+
+    def flush():
+        if block is not None and block.rows:
+            nodes.extend(block.to_nodes())
+
+    for doc in documents:
+        page_label = doc.metadata.get("page_label", "")
+        page_notes = []
+        for kind, item in scan_lines(doc.get_content()):
+            if kind == "text":
+                page_notes.append(item)
+                continue
+            code = item["code"]
+            if len(code) == 4:
+                flush()
+                heading, heading_desc = code, item["description"]
+                block = _Block(code, heading, heading_desc, page_label)
+            elif len(code) == 7 or block is None or not code.startswith(block.code):
+                # A new subheading, or a national line whose subheading row wasn't printed
+                flush()
+                block_code = code if len(code) == 7 else item["parent"]
+                if not block_code.startswith(heading):
+                    heading, heading_desc = block_code[:4], ""
+                block = _Block(block_code, heading, heading_desc, page_label)
+            block.add(item)
+        text = "\n".join(page_notes).strip()
+        if len(text) >= MIN_NOTES_CHARS:
+            notes.append(Document(text=text, metadata={"page_label": page_label}, excluded_embed_metadata_keys=EXCLUDED_EMBED_KEYS))
+    flush()
+
+    if not nodes:
+        logger.warning("No tariff rows recognised. Falling back to sentence chunking for the whole source.")
+        return SentenceSplitter(chunk_size=1024, chunk_overlap=200).get_nodes_from_documents(without_positional_metadata(documents))
+
+    note_nodes = SentenceSplitter(chunk_size=1024, chunk_overlap=100).get_nodes_from_documents(notes)
+    logger.info(f"Tariff chunking: {len(nodes)} tariff blocks, {len(note_nodes)} note chunks.")
+    return nodes + note_nodes
@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import logging
+import threading
+from src.config import STORAGE_DIR
+
+logger = logging.getLogger(__name__)
+
+CODE_TABLE_PATH = os.path.join(STORAGE_DIR, "hs_codes.json")
+
+# STCCED prints headings as "85.18", subheadings as "8518.30" and national lines as "8518.30.10"
+ROW_PATTERN = re.compile(r'^\s*(\d{2}\.\d{2}|\d{4}\.\d{2}(?:\.\d{2})?)\s+(.*\S)\s*$')
+CODE_PATTERN = re.compile(r'\b(\d{4}\.\d{2}(?:\.\d{2})?)\b')
+# Statistical units used in the schedule's "Unit of Quantity" column, and the duty rates that follow it
+UNITS = r'1000\s?u|kg|u|l|m|m2|m3|m²|m³|pr|pair|doz|kWh|g|ct|gi F/S|l alc 100%|c/k'
+DUTY = r'\d+(?:\.\d+)?%|Free|\$\d[\d,]*(?:\.\d+)?(?:\s+per\s+(?:l alc 100%|\S+))?'
+# Anchored to the end of the row so units inside a description ("not more than 10 kg") aren't taken for the column
+UNIT_PATTERN = re.compile(rf'\s+({UNITS})\s+((?:{DUTY})(?:\s+(?:{DUTY}))*)\s*$')
+
+
+def normalize_code(code: str) -> str:
+    # Accept "85.18", "8518", "851830", "8518.30.10" etc. and return the dotted STCCED form
+    digits = re.sub(r'\D', '', code or "")
+    if len(digits) == 4:
+        return digits
+    if len(digits) == 6:
+        return f"{digits[:4]}.{digits[4:]}"
+    if len(digits) == 8:
+        return f"{digits[:4]}.{digits[4:6]}.{digits[6:]}"
+    return digits
+
+
+def parent_code(code: str) -> str:
+    digits = code.replace(".", "")
+    if len(digits) == 8:
+        return normalize_code(digits[:6])
+    if len(digits) == 6:
+        return digits[:4]
+    if len(digits) == 4:
+        return digits[:2]
+    return ""
+
+
+def _split_row(text: str):
+    # Separate description from the trailing unit / duty columns
+    match = UNIT_PATTERN.search(text)
+    if match:
+        return text[:match.start()].strip(" -:"), match.group(1), match.group(2).strip()
+    return text.strip(" -:"), "", ""
+
+
+def scan_lines(text: str):
+    # Yield ("row", dict) for each code row and ("text", line) for everything else (notes, headers).
+    # Wrapped description lines are folded into the row above; "text" keeps the row's raw lines verbatim.
+    current = None
+    for line in text.splitlines():
+        row = ROW_PATTERN.match(line)
+        if row:
+            if current:
+                yield "row", current
+            code = normalize_code(row.group(1))
+            description, unit, rest = _split_row(row.group(2))
+            current = {"code": code, "description": description, "unit": unit, "duty": rest, "parent": parent_code(code), "text": line.strip()}
+        elif current and not current["unit"] and line.strip() and not CODE_PATTERN.search(line):
+            description, unit, rest = _split_row(line)
+            current["description"] = f"{current['description']} {description}".strip()
+            current["unit"], current["duty"] = unit, rest
+            current["text"] = f"{current['text']}\n{line.strip()}"
+        else:
+            if current:
+                yield "row", current
+                current = None
+            if line.strip():
+                yield "text", line
+    if current:
+        yield "row", current
+
+
+def parse_rows(text: str):
+    for kind, item in scan_lines(text):
+        if kind == "row":
+            yield item
+
+
+class HSCodeTable:
+    # Exact code → row lookup plus a prefix tree so a heading expands to its national lines without a search round
+
+    def __init__(self, entries: dict):
+        self.entries = entries
+        self.children = {}
+        self._lines_by_prefix = {}
+        for code, entry in entries.items():
+            self.children.setdefault(entry["parent"], []).append(code)
+            if len(code) == 10:
+                self._lines_by_prefix.setdefault(code[:7], []).append(code)
+                self._lines_by_prefix.setdefault(code[:4], []).append(code)
+        for codes in list(self.children.values()) + list(self._lines_by_prefix.values()):
+            codes.sort()
+
+    @classmethod
+    def from_documents(cls, documents):
+        entries = {}
+        for doc in documents:
+            for row in parse_rows(doc.get_content()):
+                # Keep the first occurrence; later hits are usually cross-references in the notes
+                row.pop("text", None)
+                entries.setdefault(row["code"], row)
+        logger.info(f"HS code table built with {len(entries)} codes.")
+        return cls(entries)
+
+    @classmethod
+    def load(cls, path: str = CODE_TABLE_PATH):
+        with open(path, "r") as f:
+            return cls(json.load(f))
+
+    def save(self, path: str = CODE_TABLE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.entries, f)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, code: str):
+        return self.entries.get(normalize_code(code))
+
+    def lines_under(self, prefix: str) -> list:
+        # All 8-digit national lines under a 4- or 6-digit heading, in schedule order
+        code = normalize_code(prefix)
+        if len(code) == 10:
+            entry = self.entries.get(code)
+            return [entry] if entry else []
+        return [self.entries[c] for c in self._lines_by_prefix.get(code, [])]
+
+    def format_lines(self, entries: list) -> str:
+        rows = []
+        for entry in entries:
+            unit = f" [{entry['unit']}]" if entry.get("unit") else ""
+            rows.append(f"{entry['code']} {entry['description']}{unit}")
+        return "\n".join(rows)
+
+    def expand(self, prefix: str) -> str:
+        # Heading line followed by every national line beneath it, ready to paste as evidence
+        code = normalize_code(prefix)
+        lines = self.lines_under(code)
+        if not lines:
+            return ""
+        # A national line is its own only line, so it gets no separate header
+        header = self.entries.get(code) if len(code) != 10 else None
+        block = [self.format_lines([header])] if header else []
+        block.append(self.format_lines(lines))
+        return "\n".join(block)
+
+
+_table = None
+_table_mtime = None
+_table_lock = threading.Lock()
+
+
+def get_code_table(path: str = CODE_TABLE_PATH):
+    # Shared table, reloaded only when the file on disk changes. None if it was never built.
+    global _table, _table_mtime
+    with _table_lock:
+        if not os.path.exists(path):
+            return None
+        mtime = os.path.getmtime(path)
+        if _table is None or mtime != _table_mtime:
+            _table = HSCodeTable.load(path)
+            _table_mtime = mtime
+        return _table
@@ -0,0 +1,71 @@
+import os
+import logging
+import threading
+from dotenv import load_dotenv
+from src.tools import startup
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+RUN_MODE = os.getenv("RUN_MODE", "cloud")
+
+# LlamaIndex's global Settings are configured on first use instead of at import, so commands that never
+# embed or open the index (--help, cache hits served from disk) don't construct the clients
+_configured = False
+_settings_lock = threading.Lock()
+
+
+def configure_settings():
+    global _configured
+    with _settings_lock:
+        if _configured:
+            return
+        with startup.phase("LlamaIndex settings"):
+            _configure()
+        _configured = True
+        logger.info("LlamaIndex settings configured.")
+
+
+def _configure():
+    from llama_index.core import Settings
+    from llama_index.embeddings.ollama import OllamaEmbedding
+
+    # Always use Ollama embeddings — the index was built with EMBEDED_MODEL (Ollama)
+    Settings.embed_model = OllamaEmbedding(
+        model_name=os.getenv("EMBEDED_MODEL"),
+        base_url=os.getenv("OLLAMA_BASE_URL")
+    )
+
+    if RUN_MODE == "local":
+        from llama_index.llms.ollama import Ollama as LlamaOllama
+        Settings.llm = LlamaOllama(model=os.getenv("LOCAL_WORKER_MODEL"), base_url=os.getenv("OLLAMA_BASE_URL"))
+    else:
+        from llama_index.llms.google_genai import GoogleGenAI
+        if os.getenv("GOOGLE_API_KEY"):
+            Settings.llm = GoogleGenAI(
+                model=os.getenv("CLOUD_WORKER_MODEL"),
+                api_key=os.getenv("GOOGLE_API_KEY")
+            )
+
+
+def set_embed_model(embed_model):
+    # Use this embedder instead of the configured one (e.g. the benchmark's offline stand-in)
+    global _configured
+    from llama_index.core import Settings
+    with _settings_lock:
+        Settings.embed_model = embed_model
+        _configured = True
+
+
+def embed_model_name() -> str:
+    # Name the query embedding cache is keyed on, without constructing the embedder when it isn't built yet
+    if not _configured:
+        return os.getenv("EMBEDED_MODEL")
+    embed_model = get_embed_model()
+    return getattr(embed_model, "model_name", type(embed_model).__name__)
+
+
+def get_embed_model():
+    configure_settings()
+    from llama_index.core import Settings
+    return Settings.embed_model
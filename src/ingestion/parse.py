@@ -1,92 +1,287 @@
 import os
-import shutil
+import json
 import time
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from llama_index.core import (
     VectorStoreIndex, 
     SimpleDirectoryReader, 
-    StorageContext, 
     load_index_from_storage,
-    Settings
 )
 from llama_index.core.node_parser import SentenceSplitter
-from llama_index.embeddings.ollama import OllamaEmbedding
+from llama_index.core.schema import MetadataMode
+from src.config import STORAGE_DIR
+from src.ingestion.hs_codes import HSCodeTable, CODE_TABLE_PATH
+from src.ingestion.chunking import tariff_nodes_from_documents, without_positional_metadata
+from src.tools.lexical_index import BM25Index, LEXICAL_INDEX_PATH
+from src.tools.heading_index import HeadingIndex, HEADING_INDEX_PATH
+from src.tools.llm_calls import embed_with_limit
+from src.tools.vector_store import new_storage_context, load_storage_context
+from src.ingestion.llama_settings import configure_settings, get_embed_model
 
 load_dotenv()
-RUN_MODE = os.getenv("RUN_MODE", "cloud")
+SOURCE_PDF = "./data/stcced2022.pdf"
+MANIFEST_PATH = os.path.join(STORAGE_DIR, "manifest.json")
+# Beside the storage dir it feeds, so each STORAGE_DIR keeps its own embedding checkpoint whatever the CWD
+CHECKPOINT_DIR = os.getenv("INGEST_CHECKPOINT_DIR", f"{os.path.normpath(STORAGE_DIR)}_checkpoint")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "35"))
+CHUNKING = os.getenv("CHUNKING", "tariff")
 
-# Always use Ollama embeddings — the index was built with EMBEDED_MODEL (Ollama)
-Settings.embed_model = OllamaEmbedding(
-    model_name=os.getenv("EMBEDED_MODEL"),
-    base_url=os.getenv("OLLAMA_BASE_URL")
-)
-
-if RUN_MODE == "local":
-    from llama_index.llms.ollama import Ollama as LlamaOllama
-    model_name = os.getenv("LOCAL_WORKER_MODEL")
-    Settings.llm = LlamaOllama(model=model_name, base_url=os.getenv("OLLAMA_BASE_URL"))
-else:
-    from llama_index.llms.google_genai import GoogleGenAI
-    if os.getenv("GOOGLE_API_KEY"):
-        Settings.llm = GoogleGenAI(
-            model=os.getenv("CLOUD_WORKER_MODEL"),
-            api_key=os.getenv("GOOGLE_API_KEY")
-        )
-
-def parse_document():
+def parse_document(source: str = SOURCE_PDF):
     print("Parsing STCCED 2022 PDF... (Using Free Standard Loader)")
-    documents = SimpleDirectoryReader(input_files=["./data/stcced2022.pdf"]).load_data()
+    documents = SimpleDirectoryReader(input_files=[source], filename_as_id=True).load_data()
     return documents
 
-def get_or_create_index():
+def split_nodes(documents):
+    # "tariff" emits one node per heading/subheading block with code metadata; "sentence" is the old fixed-size split
+    if CHUNKING == "tariff":
+        nodes = tariff_nodes_from_documents(documents)
+    else:
+        splitter = SentenceSplitter(chunk_size=1024, chunk_overlap=200)
+        nodes = splitter.get_nodes_from_documents(without_positional_metadata(documents))
+    assign_content_ids(nodes)
+    return nodes
+
+def assign_content_ids(nodes):
+    # Node id = hash of the text that gets embedded, so an unchanged chunk keeps its id (and its embedding)
+    # across re-parses and amended schedules. Repeated identical chunks get an occurrence suffix.
+    seen = {}
+    for node in nodes:
+        digest = hashlib.sha1(node.get_content(metadata_mode=MetadataMode.EMBED).encode("utf-8")).hexdigest()[:20]
+        count = seen.get(digest, 0)
+        seen[digest] = count + 1
+        node.id_ = digest if count == 0 else f"{digest}_{count}"
+    return nodes
+
+def embed_model_key() -> str:
+    embed_model = get_embed_model()
+    return f"{type(embed_model).__name__}:{getattr(embed_model, 'model_name', '')}"
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_checkpoint(model_key: str) -> dict:
+    # content-hash node_id → embedding for every batch finished by an earlier run with the same embedder
+    meta_path = os.path.join(CHECKPOINT_DIR, "meta.json")
+    data_path = os.path.join(CHECKPOINT_DIR, "embeddings.jsonl")
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            if json.load(f).get("embed_model") != model_key:
+                print("Checkpoint was built with a different embedding model. Discarding it.")
+                shutil.rmtree(CHECKPOINT_DIR)
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    with open(meta_path, "w") as f:
+        json.dump({"embed_model": model_key}, f)
+
+    done = {}
+    if os.path.exists(data_path):
+        with open(data_path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn last line from an interrupted write; that batch is simply redone
+                    continue
+                done[record["id"]] = record["embedding"]
+    return done
+
+def embed_batch(batch):
+    embed_model = get_embed_model()
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+    return embed_with_limit(embed_model, texts, lambda: embed_model.get_text_embedding_batch(texts))
+
+def compact_checkpoint_ids(keep_ids: set):
+    # Keep only embeddings of chunks that are still in the index so the checkpoint doesn't grow forever
+    data_path = os.path.join(CHECKPOINT_DIR, "embeddings.jsonl")
+    if not os.path.exists(data_path):
+        return
+    tmp_path = data_path + ".tmp"
+    with open(data_path, "r") as src, open(tmp_path, "w") as dst:
+        for line in src:
+            try:
+                if json.loads(line)["id"] in keep_ids:
+                    dst.write(line)
+            except (ValueError, KeyError):
+                continue
+    os.replace(tmp_path, data_path)
+
+def embed_nodes_checkpointed(nodes, workers: int = INGEST_WORKERS, batch_size: int = INGEST_BATCH_SIZE):
+    # Embed batches concurrently, appending each finished batch to the checkpoint so a crash only loses in-flight work
+    done = load_checkpoint(embed_model_key())
+    for node in nodes:
+        if node.node_id in done:
+            node.embedding = done[node.node_id]
+    pending = [node for node in nodes if node.embedding is None]
+    print(f"Resuming with {len(nodes) - len(pending)}/{len(nodes)} chunks already embedded." if done else f"Embedding {len(pending)} chunks...")
+
+    batches = [pending[i : i + batch_size] for i in range(0, len(pending), batch_size)]
+    failed = 0
+    completed = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool, open(os.path.join(CHECKPOINT_DIR, "embeddings.jsonl"), "a") as checkpoint:
+        futures = {pool.submit(embed_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                embeddings = future.result()
+            except Exception as e:
+                failed += len(batch)
+                print(f"Error embedding batch of {len(batch)} chunks: {e}")
+                continue
+            for node, embedding in zip(batch, embeddings):
+                node.embedding = embedding
+                checkpoint.write(json.dumps({"id": node.node_id, "embedding": embedding}) + "\n")
+            checkpoint.flush()
+            completed += len(batch)
+            elapsed = time.perf_counter() - start
+            print(f"> {completed}/{len(pending)} chunks embedded ({completed / elapsed:.1f} chunks/s)")
+
+    if failed:
+        raise RuntimeError(f"{failed} chunks failed to embed. Re-run to resume from the checkpoint in {CHECKPOINT_DIR}.")
+    return nodes
+
+def write_manifest(source: str, nodes):
+    # Records which source file/version produced the index and which chunk ids it holds
+    manifest = {
+        "source_file": os.path.abspath(source),
+        "source_sha256": file_sha256(source),
+        "source_version": os.getenv("STCCED_VERSION", os.path.basename(source)),
+        "embed_model": embed_model_key(),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "node_ids": sorted(node.node_id for node in nodes),
+    }
+    with open(MANIFEST_PATH, "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH, "r") as f:
+        return json.load(f)
+
+def build_code_table(documents):
+    # Exact HS-code table persisted next to the vector index
+    table = HSCodeTable.from_documents(documents)
+    table.save(CODE_TABLE_PATH)
+    print(f"HS code table saved ({len(table)} codes).")
+    return table
+
+def build_lexical_index(index):
+    # BM25 over the exact nodes that were embedded, for hybrid retrieval
+    lexical = BM25Index.from_docstore(index.docstore)
+    lexical.save(LEXICAL_INDEX_PATH)
+    print(f"BM25 index saved ({len(lexical.doc_ids)} nodes).")
+    return lexical
+
+def build_heading_index(index):
+    # Heading centroids for hierarchical retrieval, averaged from the embeddings already in the vector store
+    headings = HeadingIndex.from_index(index)
+    headings.save(HEADING_INDEX_PATH)
+    print(f"Heading index saved ({len(headings)} headings).")
+    return headings
+
+def get_or_create_index(source: str = SOURCE_PDF):
+    configure_settings()
     # Check existing storage
-    if os.path.exists("./storage"):
+    if os.path.exists(STORAGE_DIR):
         print("Loading existing index from disk...")
         try:
-            storage_context = StorageContext.from_defaults(persist_dir="./storage")
-            index = load_index_from_storage(storage_context)
-            return index
+            index = load_index_from_storage(load_storage_context(STORAGE_DIR))
         except Exception as e:
             print(f"Index corrupted ({e}). Deleting and rebuilding...")
-            shutil.rmtree("./storage")
+            shutil.rmtree(STORAGE_DIR)
+        else:
+            if not os.path.exists(CODE_TABLE_PATH):
+                # Older storage predates the code table; parsing is cheap compared to embedding
+                print("HS code table missing. Building it from the schedule...")
+                try:
+                    build_code_table(parse_document())
+                except Exception as e:
+                    print(f"Could not build HS code table ({e}). Exact lookups disabled.")
+            if not os.path.exists(LEXICAL_INDEX_PATH):
+                build_lexical_index(index)
+            if not os.path.exists(HEADING_INDEX_PATH):
+                build_heading_index(index)
+            return index
 
-    # Build New Index
+    # Build New Index. Embeddings already in the checkpoint (keyed by content hash) are reused,
+    # so rebuilding after a corrupted index does not re-embed the schedule.
     print("Building new Knowledge Base (Gemini 2.5 Flash Lite)...")
-    documents = parse_document()
+    documents = parse_document(source)
     
-    splitter = SentenceSplitter(chunk_size=1024, chunk_overlap=200)
-    nodes = splitter.get_nodes_from_documents(documents)
+    nodes = split_nodes(documents)
     print(f"Total chunks to process: {len(nodes)}")
 
-    index = VectorStoreIndex([])
-
-    # Insert in batches
-    BATCH_SIZE = 35
-    for i in range(0, len(nodes), BATCH_SIZE):
-        batch = nodes[i : i + BATCH_SIZE]
-        
-        for attempt in range(3):
-            try:
-                print(f"> Processing batch {(i // BATCH_SIZE) + 1} ({len(batch)} items)...")
-                index.insert_nodes(batch)
-                
-                if RUN_MODE != "local":
-                    print("Cooldown 240s to fully reset Token Quota...")
-                    time.sleep(240) 
-                break 
-            except Exception as e:
-                print(f"Error: {e}")
-                if "429" in str(e) and RUN_MODE != "local":
-                    print("Rate limit hit. Waiting 7 minutes...")
-                    time.sleep(420)
-                else:
-                    break
+    embed_nodes_checkpointed(nodes)
+    # Every node already carries its embedding, so this only assembles the index
+    index = VectorStoreIndex(nodes, storage_context=new_storage_context())
 
     print("Indexing Complete! Saving to disk...")
-    index.storage_context.persist(persist_dir="./storage")
+    index.storage_context.persist(persist_dir=STORAGE_DIR)
+    build_code_table(documents)
+    build_lexical_index(index)
+    build_heading_index(index)
+    write_manifest(source, nodes)
+    compact_checkpoint_ids({node.node_id for node in nodes})
+    return index
+
+def update_index(source: str = SOURCE_PDF):
+    # Incremental re-ingest: only chunks whose content hash is new get embedded, vanished chunks are deleted.
+    # Cost is proportional to the diff against the manifest, not to the size of the schedule.
+    configure_settings()
+    manifest = load_manifest()
+    if manifest is None or not os.path.exists(STORAGE_DIR):
+        print("No manifest found. Falling back to a full build.")
+        if os.path.exists(STORAGE_DIR):
+            shutil.rmtree(STORAGE_DIR)
+        return get_or_create_index(source)
+    if manifest.get("embed_model") != embed_model_key():
+        print("Index was built with a different embedding model. Full rebuild required.")
+        shutil.rmtree(STORAGE_DIR)
+        return get_or_create_index(source)
+    if manifest.get("source_sha256") == file_sha256(source):
+        print("Source file unchanged. Nothing to update.")
+        return get_or_create_index()
+
+    index = load_index_from_storage(load_storage_context(STORAGE_DIR))
+
+    documents = parse_document(source)
+    nodes = split_nodes(documents)
+    old_ids = set(manifest.get("node_ids", []))
+    new_ids = {node.node_id for node in nodes}
+    removed = sorted(old_ids - new_ids)
+    added = [node for node in nodes if node.node_id not in old_ids]
+    print(f"Incremental update: {len(added)} new/changed chunks, {len(removed)} removed, {len(new_ids & old_ids)} unchanged.")
+
+    if removed:
+        index.delete_nodes(removed, delete_from_docstore=True)
+    if added:
+        embed_nodes_checkpointed(added)
+        index.insert_nodes(added)
+
+    index.storage_context.persist(persist_dir=STORAGE_DIR)
+    build_code_table(documents)
+    build_lexical_index(index)
+    build_heading_index(index)
+    write_manifest(source, nodes)
+    compact_checkpoint_ids(new_ids)
+    print("Incremental update complete.")
     return index
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Build or update the STCCED knowledge base")
+    parser.add_argument("--update", nargs="?", const=SOURCE_PDF, help="Incrementally re-ingest an amended schedule (defaults to the configured PDF)")
+    args = parser.parse_args()
+
     if not os.path.exists("./data"): os.makedirs("./data")
-    index = get_or_create_index()
+    index = update_index(args.update) if args.update else get_or_create_index()
     print("Knowledge base is ready.")
\ No newline at end of file
@@ -1,3 +1,4 @@
+import os
 import argparse
 import logging
 import traceback
@@ -5,8 +6,7 @@ import uuid
 import sys
 import time
 from dotenv import load_dotenv
-from src.graph.builder import graph
-from src.ingestion.parse import get_or_create_index
+from src.tools import startup
 
 def setup_logging():
     # Configure logger
@@ -33,32 +33,77 @@ def setup_logging():
     sys.stderr = StreamToLogger(logging.ERROR)
     return logger
 
-logger = setup_logging()
+logger = logging.getLogger()
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Autonomous Regulatory Auditor")
+    parser.add_argument("query", type=str, nargs="?", help="The product to classify")
+    parser.add_argument("--thread", type=str, default=str(uuid.uuid4())[:8], help="Unique Audit ID")
+    parser.add_argument("--resume", type=str, metavar="THREAD", help="Continue an interrupted audit from its last checkpoint")
+    parser.add_argument("--batch", type=str, help="CSV or JSONL file of products to classify in one warm process")
+    parser.add_argument("--output", type=str, default="batch_results.jsonl", help="JSONL file batch results are appended to")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum audits running at once in batch mode")
+    parser.add_argument("--classification-cache", action="store_true", help="Serve near-duplicate products from the semantic cache of approved classifications (opt-in)")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the classification cache lookup and always run the full graph")
+    parser.add_argument("--llm-cache", action="store_true", help="Serve repeated model calls (same model, parameters and prompt) from the on-disk response cache")
+    parser.add_argument("--trace-out", type=str, help="Write the run's spans (nodes, LLM calls, embeddings, retrievals) to this JSON file")
+    return parser
+
+def init_knowledge_base(index_handle):
+    # Build only when something is missing; an existing index is loaded by the first retrieval that needs it,
+    # so a cache hit never pays for it
+    if index_handle.storage_ready():
+        logger.info("Knowledge base found. Index will load on first retrieval.")
+        return
+    from src.ingestion.parse import get_or_create_index
+    logger.info("Initializing knowledge base...")
+    index_handle.warm(get_or_create_index())
+    logger.info(f"Index handle: {index_handle.stats()}")
 
 def main():
+    # Arguments are checked before anything heavy is imported, so --help and usage errors return at once
+    with startup.phase("parse arguments"):
+        parser = build_parser()
+        args = parser.parse_args()
+        if not (args.batch or args.resume or args.query):
+            parser.error("a query is required unless --batch or --resume is given")
+    setup_logging()
     load_dotenv()
     start_time = time.time()
+    if args.llm_cache:
+        os.environ["LLM_CACHE"] = "on"
+    if args.classification_cache:
+        os.environ["CLASSIFICATION_CACHE"] = "on"
 
-    logger.info("Initializing knowledge base...")
-    get_or_create_index()
+    with startup.phase("import search + caches"):
+        from src.tools.search_tool import index_handle, get_retrieval_cache
+        from src.tools.tracing import trace_run
+        from src.tools.llm_calls import get_llm_cache
+        from src.tools.model_cascade import format_tiers
+    with startup.phase("import graph builder"):
+        from src.graph.builder import run_audit, resume_audit, get_classification_cache
+    with startup.phase("knowledge base check"):
+        init_knowledge_base(index_handle)
+    startup.log_report()
 
-    parser = argparse.ArgumentParser(description="Autonomous Regulatory Auditor")
-    parser.add_argument("query", type=str, help="The product to classify")
-    parser.add_argument("--thread", type=str, default=str(uuid.uuid4())[:8], help="Unique Audit ID")
-    args = parser.parse_args()
+    if args.batch:
+        from src.batch import run_batch
+        run_batch(args.batch, args.output, concurrency=args.concurrency, use_cache=not args.no_cache)
+        return
+    if args.resume:
+        args.thread = args.resume
 
-    config = {"configurable": {"thread_id": f"audit_{args.thread}"}}
-    
-    initial_state = {
-        "query": args.query,
-        "worker_results": [],
-        "step_count": 0
-    }
-    
     logger.info(f"--- STARTING AUDIT: {args.thread} ---")
     
     try:
-        final_state = graph.invoke(initial_state, config=config)
+        with trace_run(args.thread, args.query) as trace:
+            if args.resume:
+                final_state = resume_audit(args.resume)
+                args.query = final_state.get("query")
+            else:
+                final_state = run_audit(args.query, args.thread, use_cache=not args.no_cache)
+        if args.trace_out:
+            trace.export(args.trace_out)
         end_time = time.time()
         latency = end_time - start_time
         faith_score = final_state.get("faithfulness_score", 0.0)
@@ -67,23 +112,44 @@ def main():
         # Asumming using token cost from GROQ, can change based on your LLM pricing
         token_cost = (total_tokens / 1000) * 0.0006 
 
+        retrieval_cache = get_retrieval_cache()
+        if retrieval_cache is not None:
+            logger.info(f"Retrieval cache: {retrieval_cache.stats()}")
+        classification_cache = get_classification_cache()
+        if classification_cache is not None:
+            logger.info(f"Classification cache: {classification_cache.stats()}")
+        llm_cache = get_llm_cache()
+        llm_cache_line = f"\n- LLM Cache: {llm_cache.stats()}" if llm_cache is not None else ""
+        if index_handle.load_count:
+            # The index loads lazily inside the first retrieval; report it with the other one-off costs
+            startup.record_phase("index load", index_handle.load_seconds)
+
         print(f"""
 BENCHMARK REPORT
 ------------------------------------
 QUERY: {args.query}
 HS-CODE: {final_state.get('final_hscode', 'N/A')}
 CONFIDENCE: {final_state.get('final_confidence', 'N/A')}
+CACHE HIT: {final_state.get('cache_hit', False)}
+MODEL TIERS: {format_tiers(final_state.get('model_tiers'))}
 
 PARETO FRONTIER:
-- Accuracy (Faithfulness): {faith_score:.2f}
+- Accuracy (Faithfulness): {faith_score:.2f} (decided by {final_state.get('audit_path', 'N/A')} in {final_state.get('audit_seconds', 0.0):.2f}s)
 - Latency: {latency:.2f}s (Target: <60s)
-- Token Cost: ${token_cost:.6f}
+- Token Cost: ${token_cost:.6f} ({total_tokens} tokens){llm_cache_line}
+
+PER-NODE BREAKDOWN:
+{trace.format_report()}
+
+STARTUP:
+{startup.format_report()}
 ------------------------------------
 """)
         
     except Exception as e:
         logger.error(f"Audit failed: {e}")
         logger.error(traceback.format_exc())
+        logger.error(f"Progress up to the last completed step is checkpointed. Resume with: --resume {args.thread}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import array
+import sqlite3
+import logging
+import threading
+import numpy as np
+from src.agents.state import latest_records, latest_chunks, evidence_record
+
+logger = logging.getLogger(__name__)
+
+CLASSIFICATION_CACHE_PATH = os.getenv("CLASSIFICATION_CACHE_PATH", "./cache/classification_cache.sqlite")
+CLASSIFICATION_CACHE_MAX_ENTRIES = int(os.getenv("CLASSIFICATION_CACHE_MAX_ENTRIES", "20000"))
+# Cosine similarity a new query needs to a cached one to reuse its answer
+CLASSIFICATION_CACHE_THRESHOLD = float(os.getenv("CLASSIFICATION_CACHE_THRESHOLD", "0.95"))
+
+# Final-state fields worth replaying; everything else is per-run bookkeeping
+CACHED_FIELDS = ("final_hscode", "final_confidence", "verification_claims", "faithfulness_score", "status", "critique")
+
+
+class ClassificationCache:
+    # APPROVED audit results keyed by query embedding. Lookups are a single matrix-vector product over
+    # the entries for the current index version, held in memory; SQLite only provides persistence.
+
+    def __init__(self, path: str = CLASSIFICATION_CACHE_PATH, max_entries: int = CLASSIFICATION_CACHE_MAX_ENTRIES,
+                 threshold: float = CLASSIFICATION_CACHE_THRESHOLD):
+        self.path = path
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS classifications (id INTEGER PRIMARY KEY, query TEXT, embedding BLOB, "
+            "index_version TEXT, result TEXT, created REAL, last_used REAL)"
+        )
+        self._conn.commit()
+        self._index_version = None
+        self._ids = []
+        self._matrix = None
+
+    def _reload(self):
+        rows = self._conn.execute(
+            "SELECT id, embedding FROM classifications WHERE index_version = ?", (self._index_version,)
+        ).fetchall()
+        self._ids = [row[0] for row in rows]
+        if rows:
+            matrix = np.array([array.array("f", row[1]).tolist() for row in rows], dtype=np.float32)
+            self._matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        else:
+            self._matrix = None
+
+    def set_index_version(self, version: str):
+        # Answers are only valid for the index they were derived from
+        with self._lock:
+            if version == self._index_version:
+                return
+            deleted = self._conn.execute("DELETE FROM classifications WHERE index_version != ?", (version,)).rowcount
+            self._conn.commit()
+            if deleted:
+                logger.info(f"Classification cache: index version changed, dropped {deleted} stale entries.")
+            self._index_version = version
+            self._reload()
+
+    def lookup(self, embedding: list):
+        # Returns (cached_state, similarity, cached_query) or None
+        with self._lock:
+            if self._matrix is None:
+                self.misses += 1
+                return None
+            vector = np.asarray(embedding, dtype=np.float32)
+            vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+            scores = self._matrix @ vector
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+            row_id = self._ids[best]
+            row = self._conn.execute("SELECT query, result FROM classifications WHERE id = ?", (row_id,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE classifications SET last_used = ? WHERE id = ?", (time.time(), row_id))
+            self._conn.commit()
+            self.hits += 1
+            cached = json.loads(row[1])
+            if isinstance(cached.get("evidence"), str):
+                # Entries written before evidence kept its record structure hold the flattened text
+                cached["evidence"] = evidence_record(0, row[0], [("cached", cached["evidence"])], "", [])
+            return cached, similarity, row[0]
+
+    def store(self, query: str, embedding: list, final_state: dict):
+        if final_state.get("status") != "APPROVED":
+            return
+        result = {k: final_state.get(k) for k in CACHED_FIELDS}
+        # The approving attempt's evidence, in the same {"records", "chunks"} shape as the live state
+        result["evidence"] = {"records": latest_records(final_state), "chunks": dict(latest_chunks(final_state))}
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO classifications (query, embedding, index_version, result, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (query, array.array("f", embedding).tobytes(), self._index_version, json.dumps(result), now, now)
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+            evicted = count > self.max_entries
+            if evicted:
+                self._conn.execute(
+                    "DELETE FROM classifications WHERE id IN (SELECT id FROM classifications ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+            if evicted:
+                self._reload()
+            else:
+                # Append in place instead of re-reading every row
+                vector = np.asarray(embedding, dtype=np.float32)
+                vector = (vector / max(float(np.linalg.norm(vector)), 1e-12))[None, :]
+                self._matrix = vector if self._matrix is None else np.vstack([self._matrix, vector])
+                self._ids.append(cursor.lastrowid)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._ids)}
@@ -1,27 +1,22 @@
-import os
 from deepeval.models.base_model import DeepEvalBaseLLM
-from langchain_groq import ChatGroq
+from src.tools.llm_calls import invoke_llm, ainvoke_llm
+from src.tools.model_cascade import model_tiers, get_model
 
 class GroqDeepEvalLLM(DeepEvalBaseLLM):
-    def __init__(self, model_name=None):
-        RUN_MODE = os.getenv("RUN_MODE", "cloud")
-        if RUN_MODE == "local":
-            self.model_name = model_name or os.getenv("LOCAL_GROQ_MODEL")
-            from langchain_ollama import ChatOllama
-            self.llm = ChatOllama(model=self.model_name, base_url=os.getenv("OLLAMA_BASE_URL"), format="json")
-        else:
-            self.model_name = model_name or os.getenv("CLOUD_GROQ_MODEL")
-            self.llm = ChatGroq(model=self.model_name)
+    # DeepEval judge backed by one tier of the "judge" cascade (tier 0 unless the auditor escalates)
+    def __init__(self, tier: int = 0):
+        self.tier = tier
+        self.model_name = model_tiers("judge")[tier]
 
     def load_model(self):
-        return self.llm
+        return get_model("judge", self.tier)
 
     def generate(self, prompt: str) -> str:
-        return self.llm.invoke(prompt).content
+        return invoke_llm(self.load_model(), prompt).content
 
     async def a_generate(self, prompt: str) -> str:
-        res = await self.llm.ainvoke(prompt)
+        res = await ainvoke_llm(self.load_model(), prompt)
         return res.content
 
     def get_model_name(self):
-        return self.model_name
\ No newline at end of file
+        return self.model_name
@@ -0,0 +1,86 @@
+import os
+import logging
+from src.tools.lexical_index import BM25Index, reciprocal_rank_fusion
+from src.tools.token_counter import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Per-node prompt budgets, in tokens of the model that reads the prompt
+WORKER_EVIDENCE_TOKENS = int(os.getenv("WORKER_EVIDENCE_TOKENS", "1500"))
+AGGREGATOR_EVIDENCE_TOKENS = int(os.getenv("AGGREGATOR_EVIDENCE_TOKENS", "1500"))
+AGGREGATOR_ANALYSIS_TOKENS = int(os.getenv("AGGREGATOR_ANALYSIS_TOKENS", "600"))
+
+# Where the worker's structured answer starts; kept whole when its analysis is trimmed
+ANSWER_MARKER = "Found Code"
+
+
+def rerank_pool(query: str, fresh: list, prior: list) -> list:
+    # Merge this attempt's retrieval with evidence gathered on earlier attempts and rank the union.
+    # fresh/prior: [(node_id, text)]. Fresh results keep their retrieval order as one ranking; a BM25 pass
+    # over the whole pool against the query is the other, so a prior chunk that answers the critique can win.
+    pool = dict(prior)
+    pool.update(fresh)
+    if not pool:
+        return []
+    lexical = BM25Index.from_texts(pool.items()).search(query, top_k=len(pool))
+    fused = reciprocal_rank_fusion(
+        [[node_id for node_id, _ in fresh], [node_id for node_id, _ in lexical]],
+        [1.0, 1.0],
+    )
+    ranked = [node_id for node_id, _ in fused]
+    seen = set(ranked)
+    # Chunks neither ranking mentioned (no lexical overlap, not retrieved again) go last in their old order
+    ranked.extend(node_id for node_id in pool if node_id not in seen)
+    return [(node_id, pool[node_id]) for node_id in ranked]
+
+
+def _fit_lines(lines: list, budget_tokens: int, model_name=None):
+    # Leading whole lines that fit; a tariff line is never cut mid-row. Returns (lines, tokens).
+    kept, used = [], 0
+    for line in lines:
+        cost = count_tokens(line + "\n", model_name)
+        if used + cost > budget_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return kept, used
+
+
+def _log_savings(label: str, detail: str, used: int, total: int, budget_tokens: int):
+    if used < total:
+        logger.info(f"Evidence packer [{label}]: {detail}, {used}/{budget_tokens} tokens, saved {total - used} tokens.")
+
+
+def pack_chunks(chunks: list, budget_tokens: int = WORKER_EVIDENCE_TOKENS, model_name=None, label: str = "worker") -> list:
+    # Highest-ranked whole chunks that fit the budget. A chunk that doesn't fit is skipped (a smaller one
+    # further down may still fit); only an oversized top chunk is cut, on a line boundary.
+    packed, used, total = [], 0, 0
+    for node_id, text in chunks:
+        cost = count_tokens(text, model_name)
+        total += cost
+        if used + cost <= budget_tokens:
+            packed.append((node_id, text))
+            used += cost
+        elif not packed:
+            kept, kept_cost = _fit_lines(text.splitlines(), budget_tokens - used, model_name)
+            if kept:
+                packed.append((node_id, "\n".join(kept)))
+                used += kept_cost
+    _log_savings(label, f"kept {len(packed)}/{len(chunks)} chunks", used, total, budget_tokens)
+    return packed
+
+
+def pack_analysis(text: str, budget_tokens: int = AGGREGATOR_ANALYSIS_TOKENS, model_name=None, label: str = "aggregator") -> str:
+    # Trim a worker analysis to budget. The structured answer (Found Code onwards) is kept whole and the
+    # budget left over goes to the leading lines, which is where the copied tariff lines are.
+    total = count_tokens(text, model_name)
+    if total <= budget_tokens:
+        return text
+    lines = text.splitlines()
+    start = next((i for i, line in enumerate(lines) if ANSWER_MARKER in line), len(lines))
+    answer, answer_cost = _fit_lines(lines[start:], budget_tokens, model_name)
+    head, head_cost = _fit_lines(lines[:start], budget_tokens - answer_cost, model_name)
+    if len(head) < start:
+        head.append("[...]")
+    _log_savings(label, f"analysis kept {len(head) + len(answer)}/{len(lines)} lines", head_cost + answer_cost, total, budget_tokens)
+    return "\n".join(head + answer)
@@ -0,0 +1,84 @@
+import os
+import json
+import logging
+import numpy as np
+from src.config import STORAGE_DIR
+
+logger = logging.getLogger(__name__)
+
+HEADING_INDEX_PATH = os.path.join(STORAGE_DIR, "heading_index.json")
+HEADING_VECTORS_FILE = "heading_vectors.npy"
+
+
+def _embedding(vector_store, node_id: str):
+    try:
+        return vector_store.get(node_id)
+    except KeyError:
+        return None
+
+
+class HeadingIndex:
+    # The schedule's tree above the chunks: each 4-digit heading with its member node ids and one vector, the
+    # normalized mean of its members' embeddings. Ranking ~1,200 headings is cheap, and it narrows the chunk
+    # search to a few subtrees. Chapters are the first two digits of a heading.
+
+    def __init__(self, headings: list, members: dict, centroids: np.ndarray):
+        self.headings = headings
+        self.members = members
+        self.centroids = centroids
+        self.heading_of = {node_id: heading for heading, node_ids in members.items() for node_id in node_ids}
+
+    @classmethod
+    def from_index(cls, index):
+        # Tariff nodes carry "heading" metadata from chunking; note chunks have none and stay outside the tree.
+        # Embeddings come from the vector store, so building this costs no embedding calls.
+        members = {}
+        for node_id, node in index.docstore.docs.items():
+            heading = (node.metadata or {}).get("heading")
+            if heading:
+                members.setdefault(heading, []).append(node_id)
+
+        headings, rows = [], []
+        for heading in sorted(members):
+            vectors = [v for v in (_embedding(index.vector_store, node_id) for node_id in members[heading]) if v is not None]
+            if not vectors:
+                continue
+            vectors = np.asarray(vectors, dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            mean = vectors.mean(axis=0)
+            rows.append(mean / max(np.linalg.norm(mean), 1e-12))
+            headings.append(heading)
+        centroids = np.asarray(rows, dtype=np.float32) if rows else np.zeros((0, 0), dtype=np.float32)
+        logger.info(f"Heading index built over {len(headings)} headings in {len({h[:2] for h in headings})} chapters.")
+        return cls(headings, {h: members[h] for h in headings}, centroids)
+
+    @classmethod
+    def load(cls, path: str = HEADING_INDEX_PATH):
+        with open(path, "r") as f:
+            data = json.load(f)
+        centroids = np.load(os.path.join(os.path.dirname(path), HEADING_VECTORS_FILE))
+        return cls(data["headings"], data["members"], centroids)
+
+    def save(self, path: str = HEADING_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.save(os.path.join(os.path.dirname(path), HEADING_VECTORS_FILE), self.centroids)
+        with open(path, "w") as f:
+            json.dump({"headings": self.headings, "members": self.members}, f)
+
+    def __len__(self):
+        return len(self.headings)
+
+    def rank(self, query_embedding) -> list:
+        # [heading] best first by cosine to the heading centroid
+        if not self.headings:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        scores = self.centroids @ (query / max(np.linalg.norm(query), 1e-12))
+        return [self.headings[i] for i in np.argsort(-scores)]
+
+    def rank_by_hits(self, hits: list) -> list:
+        # [heading] in order of their best-ranked member in a chunk ranking [(node_id, score)]
+        return list(dict.fromkeys(self.heading_of[node_id] for node_id, _ in hits if node_id in self.heading_of))
+
+    def nodes_under(self, headings: list) -> list:
+        return [node_id for heading in headings for node_id in self.members.get(heading, [])]
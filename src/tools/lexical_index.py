@@ -0,0 +1,103 @@
+import os
+import re
+import json
+import math
+import logging
+from collections import Counter
+from src.config import STORAGE_DIR
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_PATH = os.path.join(STORAGE_DIR, "bm25_index.json")
+
+TOKEN_PATTERN = re.compile(r'\d{4}\.\d{2}\.\d{2}|\d{4}\.\d{2}|\d{2}\.\d{2}|[a-z0-9]+')
+STOPWORDS = {"the", "of", "and", "or", "for", "a", "an", "in", "on", "with", "to", "by", "other", "whether", "not", "under"}
+
+
+def tokenize(text: str) -> list:
+    # Words plus HS codes kept whole. A code also emits its parents so "8518.30" matches "8518.30.10".
+    tokens = []
+    for tok in TOKEN_PATTERN.findall(text.lower()):
+        if tok in STOPWORDS:
+            continue
+        tokens.append(tok)
+        if re.fullmatch(r'\d{4}\.\d{2}\.\d{2}', tok):
+            tokens.extend([tok[:7], tok[:4]])
+        elif re.fullmatch(r'\d{4}\.\d{2}', tok):
+            tokens.append(tok[:4])
+        elif re.fullmatch(r'\d{2}\.\d{2}', tok):
+            tokens.append(tok.replace(".", ""))
+        elif len(tok) > 3 and tok.endswith("s") and not tok.endswith("ss"):
+            # Cheap plural folding: "headphones" and "headphone" should meet
+            tokens.append(tok[:-1])
+    return tokens
+
+
+class BM25Index:
+    # Okapi BM25 over the same nodes as the vector index, so exact codes and nouns are never lost to embeddings
+
+    def __init__(self, doc_ids=None, doc_lens=None, postings=None, k1: float = 1.5, b: float = 0.75):
+        self.doc_ids = doc_ids or []
+        self.doc_lens = doc_lens or []
+        self.postings = postings or {}
+        self.k1 = k1
+        self.b = b
+        self.avg_len = (sum(self.doc_lens) / len(self.doc_lens)) if self.doc_lens else 0.0
+
+    @classmethod
+    def from_texts(cls, items):
+        # items: iterable of (node_id, text)
+        doc_ids, doc_lens, postings = [], [], {}
+        for idx, (node_id, text) in enumerate(items):
+            counts = Counter(tokenize(text))
+            doc_ids.append(node_id)
+            doc_lens.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, {})[idx] = tf
+        logger.info(f"BM25 index built over {len(doc_ids)} nodes, {len(postings)} terms.")
+        return cls(doc_ids, doc_lens, postings)
+
+    @classmethod
+    def from_docstore(cls, docstore):
+        return cls.from_texts((node_id, node.get_content()) for node_id, node in docstore.docs.items())
+
+    @classmethod
+    def load(cls, path: str = LEXICAL_INDEX_PATH):
+        with open(path, "r") as f:
+            data = json.load(f)
+        postings = {term: {int(i): tf for i, tf in docs.items()} for term, docs in data["postings"].items()}
+        return cls(data["doc_ids"], data["doc_lens"], postings, data.get("k1", 1.5), data.get("b", 0.75))
+
+    def save(self, path: str = LEXICAL_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"doc_ids": self.doc_ids, "doc_lens": self.doc_lens, "postings": self.postings, "k1": self.k1, "b": self.b}, f)
+
+    def search(self, query: str, top_k: int = 5, allowed=None) -> list:
+        # Returns [(node_id, score)] best first, only over node ids in `allowed` when given.
+        # Statistics (idf, average length) stay corpus-wide so scores match an unrestricted search.
+        n_docs = len(self.doc_ids)
+        if not n_docs:
+            return []
+        scores = {}
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for idx, tf in docs.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_lens[idx] / (self.avg_len or 1))
+                scores[idx] = scores.get(idx, 0.0) + idf * tf * (self.k1 + 1) / norm
+        if allowed is not None:
+            scores = {idx: score for idx, score in scores.items() if self.doc_ids[idx] in allowed}
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(self.doc_ids[idx], score) for idx, score in best]
+
+
+def reciprocal_rank_fusion(rankings: list, weights: list, k: int = 60) -> list:
+    # Weighted RRF over several ranked lists of node ids. Returns [(node_id, fused_score)] best first.
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, node_id in enumerate(ranking):
+            fused[node_id] = fused.get(node_id, 0.0) + weight / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,98 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "./cache/llm_cache.sqlite")
+# Total size of cached responses kept on disk; least-recently-used rows go first
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "100"))
+
+# Client attributes that change what a model returns for the same prompt
+PARAM_KEYS = ("temperature", "top_p", "top_k", "max_tokens", "max_output_tokens", "seed", "format", "num_ctx")
+
+
+def model_params(llm) -> dict:
+    params = {"client": type(llm).__name__}
+    for key in PARAM_KEYS:
+        value = getattr(llm, key, None)
+        if value is not None:
+            params[key] = value
+    return params
+
+
+def cache_key(model_name: str, llm, prompt, schema=None) -> str:
+    # model + sampling parameters + prompt + structured-output schema
+    payload = {
+        "model": model_name,
+        "params": model_params(llm),
+        "prompt": prompt if isinstance(prompt, str) else repr(prompt),
+        "schema": schema.model_json_schema() if schema is not None else None,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class LLMCache:
+    # Chat responses keyed by cache_key. Values are JSON: {"result": content or parsed fields, "tokens": n}.
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_mb: float = LLM_CACHE_MAX_MB):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, value TEXT, size INTEGER, created REAL, last_used REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            entry = json.loads(row[0])
+            self.saved_tokens += entry.get("tokens", 0)
+            return entry
+
+    def put(self, key: str, model_name: str, result, tokens: int = 0):
+        value = json.dumps({"result": result, "tokens": tokens})
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, value, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, value, len(value), now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        logger.info(f"LLM cache: evicted {evicted} responses to stay under {self.max_bytes // (1024 * 1024)} MB.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "saved_tokens": self.saved_tokens,
+                "entries": entries, "size_mb": round(size / (1024 * 1024), 2)}
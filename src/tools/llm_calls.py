@@ -0,0 +1,159 @@
+import os
+import logging
+import threading
+from src.tools.llm_cache import LLMCache, cache_key
+from src.tools.rate_limiter import get_rate_limiter, estimate_tokens, is_rate_limit_error, retry_after_from_error
+from src.tools.tracing import span, record_usage
+
+logger = logging.getLogger(__name__)
+
+# Completion size assumed when reserving token quota before a call; corrected from usage afterwards
+COMPLETION_TOKEN_ESTIMATE = int(os.getenv("COMPLETION_TOKEN_ESTIMATE", "512"))
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", "3"))
+
+
+def provider_for(model) -> str:
+    # Chat models and embedders are mapped to the quota they draw from
+    name = type(model).__name__.lower()
+    if "groq" in name:
+        return "groq"
+    if "google" in name or "gemini" in name:
+        return "gemini"
+    if "ollama" in name:
+        return "ollama"
+    return "default"
+
+
+def model_name_of(model) -> str:
+    return getattr(model, "model_name", None) or getattr(model, "model", None) or type(model).__name__
+
+
+def _usage_tokens(response) -> int:
+    usage = getattr(response, "usage_metadata", None) or {}
+    return usage.get("total_tokens", 0)
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    # Opt-in (LLM_CACHE=on, or --llm-cache on the CLI). Read at call time so the CLI flag can turn it on
+    # after the models were imported. None when disabled.
+    global _llm_cache
+    if os.getenv("LLM_CACHE", "off").lower() not in ("1", "on", "true"):
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMCache()
+        return _llm_cache
+
+
+def _cache_lookup(llm, model_name: str, prompt, schema, record: dict):
+    # (key, result) — result is the replayed response on a hit, else None. key is None when caching is off.
+    cache = get_llm_cache()
+    if cache is None:
+        return None, None
+    key = cache_key(model_name, llm, prompt, schema)
+    entry = cache.get(key)
+    if entry is None:
+        return key, None
+    record["cache_hit"] = True
+    record["cached_tokens"] = entry.get("tokens", 0)
+    from langchain_core.messages import AIMessage
+    result = schema.model_validate(entry["result"]) if schema else AIMessage(content=entry["result"])
+    return key, result
+
+
+def _cache_store(key, model_name: str, result, raw, schema):
+    if key is None:
+        return
+    value = result.model_dump() if schema else result.content
+    get_llm_cache().put(key, model_name, value, _usage_tokens(raw))
+
+
+def _structured(llm, schema):
+    # include_raw keeps the AIMessage (and its usage_metadata) that structured output would otherwise drop
+    return llm.with_structured_output(schema, include_raw=True) if schema else llm
+
+
+def _unwrap(response, schema):
+    # (parsed result, raw message). Parsing failures still raise, as they did without include_raw.
+    if not schema:
+        return response, response
+    if response.get("parsing_error") is not None:
+        raise response["parsing_error"]
+    return response["parsed"], response["raw"]
+
+
+def invoke_llm(llm, prompt, schema=None):
+    # Every chat call goes through here so the provider's shared rate limiter and the opt-in response cache see it
+    provider = provider_for(llm)
+    limiter = get_rate_limiter(provider)
+    runnable = _structured(llm, schema)
+    estimated = estimate_tokens(str(prompt)) + COMPLETION_TOKEN_ESTIMATE
+    model_name = model_name_of(llm)
+    with span("llm", model_name, provider=provider, cache_hit=False) as record:
+        key, cached = _cache_lookup(llm, model_name, prompt, schema, record)
+        if cached is not None:
+            return cached
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            record["rate_limit_wait"] = record.get("rate_limit_wait", 0.0) + limiter.acquire(estimated)
+            try:
+                response = runnable.invoke(prompt)
+            except Exception as e:
+                if is_rate_limit_error(e) and attempt < RATE_LIMIT_RETRIES:
+                    limiter.penalize(retry_after_from_error(e))
+                    record["retries"] = attempt + 1
+                    continue
+                raise
+            result, raw = _unwrap(response, schema)
+            limiter.record_usage(estimated, _usage_tokens(raw))
+            record_usage(record, raw)
+            _cache_store(key, model_name, result, raw, schema)
+            return result
+
+
+async def ainvoke_llm(llm, prompt, schema=None):
+    provider = provider_for(llm)
+    limiter = get_rate_limiter(provider)
+    runnable = _structured(llm, schema)
+    estimated = estimate_tokens(str(prompt)) + COMPLETION_TOKEN_ESTIMATE
+    model_name = model_name_of(llm)
+    with span("llm", model_name, provider=provider, cache_hit=False) as record:
+        key, cached = _cache_lookup(llm, model_name, prompt, schema, record)
+        if cached is not None:
+            return cached
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            record["rate_limit_wait"] = record.get("rate_limit_wait", 0.0) + await limiter.aacquire(estimated)
+            try:
+                response = await runnable.ainvoke(prompt)
+            except Exception as e:
+                if is_rate_limit_error(e) and attempt < RATE_LIMIT_RETRIES:
+                    limiter.penalize(retry_after_from_error(e))
+                    record["retries"] = attempt + 1
+                    continue
+                raise
+            result, raw = _unwrap(response, schema)
+            limiter.record_usage(estimated, _usage_tokens(raw))
+            record_usage(record, raw)
+            _cache_store(key, model_name, result, raw, schema)
+            return result
+
+
+def embed_with_limit(embed_model, texts: list, embed_fn):
+    # Embedding calls share the same per-provider limiter; embed_fn does the actual call
+    provider = provider_for(embed_model)
+    limiter = get_rate_limiter(provider)
+    estimated = sum(estimate_tokens(t) for t in texts)
+    with span("embedding", model_name_of(embed_model), provider=provider, texts=len(texts), cache_hit=False) as record:
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            record["rate_limit_wait"] = record.get("rate_limit_wait", 0.0) + limiter.acquire(estimated)
+            try:
+                return embed_fn()
+            except Exception as e:
+                if is_rate_limit_error(e) and attempt < RATE_LIMIT_RETRIES:
+                    limiter.penalize(retry_after_from_error(e))
+                    record["retries"] = attempt + 1
+                    continue
+                raise
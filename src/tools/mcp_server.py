@@ -1,21 +1,122 @@
-from fastmcp import FastMCP
-from src.tools.search_tool import query_stcced
+import os
+import uuid
 import asyncio
+import logging
+from fastmcp import FastMCP
+from src.tools.search_tool import query_stcced, embed_queries, lookup_hs_code, index_handle
+
+logger = logging.getLogger(__name__)
 
 mcp = FastMCP("STCCED_Auditor_Server")
 
+PROMPTS_DIR = "prompts"
+# Searches (embedding call + index scan each) and full audits served at once; further calls queue
+MCP_SEARCH_CONCURRENCY = int(os.getenv("MCP_SEARCH_CONCURRENCY", "8"))
+MCP_AUDIT_CONCURRENCY = int(os.getenv("MCP_AUDIT_CONCURRENCY", "4"))
+# Queries accepted per batch call; larger batches are rejected with an error
+MCP_MAX_BATCH = int(os.getenv("MCP_MAX_BATCH", "50"))
+
+_search_slots = None
+_audit_slots = None
+_prompts = {}
+
+
+def warm_up():
+    # Everything a tool call would otherwise load on first use: LlamaIndex settings and the embedder
+    # (configured by get_or_create_index), the index and its BM25 and heading companions, and the HS code table
+    from src.ingestion.parse import get_or_create_index
+    from src.ingestion.hs_codes import get_code_table
+    from src.tools.search_tool import RETRIEVAL_MODE
+
+    index_handle.warm(get_or_create_index())
+    if RETRIEVAL_MODE != "vector":
+        index_handle.get_lexical_index()
+    if RETRIEVAL_MODE == "hierarchical":
+        index_handle.get_heading_index()
+    get_code_table()
+    # Imports the agent modules ahead of the first classify_product call without compiling anything: the
+    # async graph (and its checkpointer connection) belongs to the server's event loop and is built by that
+    # call, and the sync graph is never used here
+    import src.agents.supervisor  # noqa: F401
+    import src.agents.worker  # noqa: F401
+    import src.agents.auditor  # noqa: F401
+    logger.info(f"MCP server warm: {index_handle.stats()}")
+
+
+def search_slots() -> asyncio.Semaphore:
+    # Created lazily so it belongs to the server's event loop
+    global _search_slots
+    if _search_slots is None:
+        _search_slots = asyncio.Semaphore(MCP_SEARCH_CONCURRENCY)
+    return _search_slots
+
+
+def audit_slots() -> asyncio.Semaphore:
+    global _audit_slots
+    if _audit_slots is None:
+        _audit_slots = asyncio.Semaphore(MCP_AUDIT_CONCURRENCY)
+    return _audit_slots
+
+
+async def search(query: str, embedding: list = None) -> str:
+    # Retrieval blocks, so it runs on a worker thread and concurrent calls don't wait on each other
+    async with search_slots():
+        return await asyncio.to_thread(query_stcced, query, embedding)
+
+
 @mcp.tool()
-def search_trade_classification(query: str) -> str:
-    return query_stcced(query)
+async def search_trade_classification(query: str) -> str:
+    return await search(query)
+
+
+@mcp.tool()
+async def search_trade_classification_batch(queries: list[str]) -> list[str]:
+    # Results in the same order as the queries. All query embeddings come from one batched embedding call.
+    if len(queries) > MCP_MAX_BATCH:
+        raise ValueError(f"Batch of {len(queries)} queries exceeds the limit of {MCP_MAX_BATCH}. Split it into smaller batches.")
+    embeddings = await asyncio.to_thread(embed_queries, queries)
+    return list(await asyncio.gather(*(search(query, embeddings.get(query)) for query in queries)))
+
+
+@mcp.tool()
+async def lookup_hs_code_lines(code: str) -> str:
+    # Exact code table lookup: the row for an 8-digit line, or every national line under a 4/6-digit heading
+    # The table may still have to be loaded or reloaded from disk, so this runs off the event loop too
+    return await asyncio.to_thread(lookup_hs_code, code)
+
+
+@mcp.tool()
+async def classify_product(query: str) -> dict:
+    # The full audit graph (plan, retrieve, analyse, aggregate, audit) for one product
+    from src.graph.builder import arun_audit
+    from src.batch import summarize_final_state
+
+    async with audit_slots():
+        final_state = await arun_audit(query, f"mcp_{uuid.uuid4().hex[:8]}")
+    result = summarize_final_state(final_state)
+    result["answer"] = final_state.get("final_hscode", "")
+    return result
+
+
+def read_prompt(path: str):
+    # File contents, re-read only when the file changes on disk
+    mtime = os.path.getmtime(path)
+    cached = _prompts.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "r") as f:
+            cached = (mtime, f.read())
+        _prompts[path] = cached
+    return cached[1]
+
 
 @mcp.prompt()
 def get_decomposition_strategy(prompt_name: str) -> str:
-    path = f"prompts/{prompt_name}.md"
+    path = os.path.join(PROMPTS_DIR, f"{os.path.basename(prompt_name)}.md")
     if not os.path.exists(path):
         return f"Strategy '{prompt_name}' not found. Please use a valid prompt name."
-    
-    with open(path, "r") as f:
-        return f.read()
+    return read_prompt(path)
+
 
 if __name__ == "__main__":
-    mcp.run()
\ No newline at end of file
+    warm_up()
+    mcp.run()
@@ -0,0 +1,110 @@
+import os
+import logging
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Each node role has a list of model tiers, smallest first. {MODE}_{ROLE}_MODELS is comma-separated, e.g.
+#   CLOUD_WORKER_MODELS=gemini-2.5-flash-lite,gemini-2.5-flash
+#   CLOUD_AGGREGATOR_MODELS=llama-3.1-8b-instant,llama-3.3-70b-versatile
+# Unset, a role keeps the single model it always used, so no cascade runs.
+RUN_MODE = os.getenv("RUN_MODE", "cloud")
+ROLE_DEFAULTS = {
+    "supervisor": "GROQ_MODEL",
+    "aggregator": "GROQ_MODEL",
+    "worker": "WORKER_MODEL",
+    "judge": "GROQ_MODEL",
+}
+
+_models = {}
+_models_lock = threading.Lock()
+_model_factory = None
+
+
+def model_tiers(role: str) -> list:
+    prefix = "LOCAL" if RUN_MODE == "local" else "CLOUD"
+    names = [name.strip() for name in os.getenv(f"{prefix}_{role.upper()}_MODELS", "").split(",") if name.strip()]
+    return names or [os.getenv(f"{prefix}_{ROLE_DEFAULTS[role]}")]
+
+
+def build_model(role: str, name: str):
+    # The client each role used before tiers existed: Gemini for the cloud worker, Groq for the rest, Ollama locally
+    if RUN_MODE == "local":
+        from langchain_ollama import ChatOllama
+        extra = {"format": "json"} if role == "judge" else {}
+        return ChatOllama(model=name, base_url=os.getenv("OLLAMA_BASE_URL"), **extra)
+    if role == "worker":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(model=name, temperature=0.1)
+    from langchain_groq import ChatGroq
+    if role == "judge":
+        return ChatGroq(model=name)
+    return ChatGroq(model=name, temperature=0, verbose=True)
+
+
+def set_model_factory(factory):
+    # Replace how clients are built, e.g. with offline stand-ins: factory(role, name) -> chat model
+    global _model_factory
+    with _models_lock:
+        _model_factory = factory
+        _models.clear()
+
+
+def get_model(role: str, tier: int = 0):
+    # Shared client for a role's tier, built on first use
+    name = model_tiers(role)[tier]
+    with _models_lock:
+        key = (role, tier, name)
+        if key not in _models:
+            _models[key] = (_model_factory or build_model)(role, name)
+        return _models[key]
+
+
+def tier_record(role: str, tier: int) -> dict:
+    return {"tier": tier, "model": model_tiers(role)[tier], "of": len(model_tiers(role))}
+
+
+def format_tiers(tiers: dict) -> str:
+    # "worker=gemini-2.5-flash-lite (tier 0 of 2), ..." for reports; tier 0 is the smallest model
+    return ", ".join(f"{node}={record['model']} (tier {record['tier']} of {record['of']})" for node, record in (tiers or {}).items()) or "N/A"
+
+
+def _escalate(role: str, tier: int, reason: str):
+    names = model_tiers(role)
+    logger.info(f"Cascade [{role}]: tier {tier} ({names[tier]}) {reason}. Escalating to {names[tier + 1]}.")
+
+
+def run_cascade(role: str, call, accept):
+    # call(tier) -> result; accept(result) -> bool is the deterministic check a tier's answer must pass.
+    # The last tier's answer stands whatever the check says, and only it may raise.
+    # Returns (result, tier_record).
+    last = len(model_tiers(role)) - 1
+    for tier in range(last + 1):
+        try:
+            result = call(tier)
+        except Exception as e:
+            if tier == last:
+                raise
+            _escalate(role, tier, f"failed ({e})")
+            continue
+        if tier == last or accept(result):
+            return result, tier_record(role, tier)
+        _escalate(role, tier, "failed its check")
+
+
+async def arun_cascade(role: str, call, accept):
+    # run_cascade for a coroutine call(tier)
+    last = len(model_tiers(role)) - 1
+    for tier in range(last + 1):
+        try:
+            result = await call(tier)
+        except Exception as e:
+            if tier == last:
+                raise
+            _escalate(role, tier, f"failed ({e})")
+            continue
+        if tier == last or accept(result):
+            return result, tier_record(role, tier)
+        _escalate(role, tier, "failed its check")
@@ -0,0 +1,152 @@
+import os
+import re
+import time
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Per-provider quotas. 0 disables that dimension (local Ollama has no quota by default).
+PROVIDER_LIMITS = {
+    "groq": (int(os.getenv("GROQ_RPM", "30")), int(os.getenv("GROQ_TPM", "6000"))),
+    "gemini": (int(os.getenv("GEMINI_RPM", "10")), int(os.getenv("GEMINI_TPM", "250000"))),
+    "ollama": (int(os.getenv("OLLAMA_RPM", "0")), int(os.getenv("OLLAMA_TPM", "0"))),
+}
+# Back-off used when a provider returns 429 without saying how long to wait
+DEFAULT_RETRY_AFTER = float(os.getenv("RATE_LIMIT_DEFAULT_RETRY_AFTER", "15"))
+
+
+def parse_duration(value) -> float:
+    # "2", "7.66s", "1m2.5s", "350ms" → seconds
+    if value is None:
+        return 0.0
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    total = 0.0
+    for amount, unit in re.findall(r'([\d.]+)(ms|h|m|s)', text):
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total
+
+
+def retry_after_from_error(error) -> float:
+    # Best effort across providers: Retry-After / x-ratelimit-reset-* headers, then hints in the message
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header in ("retry-after", "x-ratelimit-reset-tokens", "x-ratelimit-reset-requests"):
+        if header in headers:
+            seconds = parse_duration(headers[header])
+            if seconds > 0:
+                return seconds
+    message = str(error)
+    match = re.search(r'retry in ([\d.]+\s*m?s)', message, re.IGNORECASE) or re.search(r'retry_delay\s*\{\s*seconds:\s*(\d+)', message)
+    if match:
+        return parse_duration(match.group(1).replace(" ", ""))
+    return 0.0
+
+
+def is_rate_limit_error(error) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    message = str(error).lower()
+    return status == 429 or "429" in message or "rate limit" in message or "resource_exhausted" in message or "resource exhausted" in message
+
+
+class RateLimiter:
+    # Token buckets for requests/min and tokens/min. Callers reserve capacity up front and sleep only
+    # for the deficit, so concurrent threads and coroutines queue fairly instead of bursting into 429s.
+
+    def __init__(self, name: str, rpm: int = 0, tpm: int = 0):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self.waited_seconds = 0.0
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def _reserve(self, tokens: int) -> float:
+        # Take capacity now (balances may go negative) and return how long the caller must wait
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self._blocked_until - now)
+            if self.rpm:
+                self._requests -= 1
+                if self._requests < 0:
+                    wait = max(wait, -self._requests * 60 / self.rpm)
+            if self.tpm and tokens:
+                tokens = min(tokens, self.tpm)
+                self._tokens -= tokens
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens * 60 / self.tpm)
+            self.waited_seconds += wait
+            return wait
+
+    def acquire(self, tokens: int = 0) -> float:
+        wait = self._reserve(tokens)
+        if wait > 0:
+            logger.info(f"Rate limiter [{self.name}]: waiting {wait:.2f}s")
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self, tokens: int = 0) -> float:
+        wait = self._reserve(tokens)
+        if wait > 0:
+            logger.info(f"Rate limiter [{self.name}]: waiting {wait:.2f}s")
+            await asyncio.sleep(wait)
+        return wait
+
+    def record_usage(self, estimated: int, actual: int):
+        # Correct the token bucket once the provider reports what the call really cost
+        if not self.tpm or not actual:
+            return
+        with self._lock:
+            self._tokens -= (actual - estimated)
+
+    def penalize(self, retry_after: float):
+        # Provider said 429: nobody using this provider proceeds until retry_after has passed
+        retry_after = retry_after or DEFAULT_RETRY_AFTER
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+            self._requests = min(self._requests, 0.0)
+        logger.warning(f"Rate limiter [{self.name}]: provider throttled us, backing off {retry_after:.2f}s")
+
+    def pending_wait(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self._blocked_until - now)
+            if self.rpm and self._requests < 1:
+                wait = max(wait, (1 - self._requests) * 60 / self.rpm)
+            return wait
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str) -> RateLimiter:
+    # One shared limiter per provider for the whole process
+    with _limiters_lock:
+        if provider not in _limiters:
+            rpm, tpm = PROVIDER_LIMITS.get(provider, (0, 0))
+            _limiters[provider] = RateLimiter(provider, rpm, tpm)
+        return _limiters[provider]
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting against a quota
+    return max(1, len(text) // 4)
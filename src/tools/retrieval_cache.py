@@ -0,0 +1,108 @@
+import os
+import re
+import json
+import time
+import array
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_CACHE_PATH = os.getenv("RETRIEVAL_CACHE_PATH", "./cache/retrieval_cache.sqlite")
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "5000"))
+
+
+def normalize_query(query: str) -> str:
+    # "  Wireless  Headphones. " and "wireless headphones" should share a cache entry
+    return re.sub(r'\s+', ' ', query.lower()).strip(" .,;:!?\"'")
+
+
+class RetrievalCache:
+    # Two-level SQLite cache: query text → embedding, and (query, top_k, mode, retrieval config, index version)
+    # → ranked node ids.
+    # Least-recently-used rows are evicted once a table exceeds max_entries.
+
+    def __init__(self, path: str = RETRIEVAL_CACHE_PATH, max_entries: int = RETRIEVAL_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = {"embedding": 0, "retrieval": 0}
+        self.misses = {"embedding": 0, "retrieval": 0}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, value BLOB, last_used REAL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS retrievals (key TEXT PRIMARY KEY, index_version TEXT, value TEXT, last_used REAL)")
+        self._conn.commit()
+        self._index_version = None
+
+    def _get(self, table: str, key: str):
+        row = self._conn.execute(f"SELECT value FROM {table} WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._conn.execute(f"UPDATE {table} SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return row
+
+    def _evict(self, table: str):
+        count = self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                f"DELETE FROM {table} WHERE key IN (SELECT key FROM {table} ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def get_embedding(self, model_name: str, query: str):
+        with self._lock:
+            row = self._get("embeddings", f"{model_name}\x00{query}")
+            if row is None:
+                self.misses["embedding"] += 1
+                return None
+            self.hits["embedding"] += 1
+            return array.array("f", row[0]).tolist()
+
+    def put_embedding(self, model_name: str, query: str, embedding: list):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, value, last_used) VALUES (?, ?, ?)",
+                (f"{model_name}\x00{query}", array.array("f", embedding).tobytes(), time.time())
+            )
+            self._evict("embeddings")
+            self._conn.commit()
+
+    def set_index_version(self, version: str):
+        # Retrieval rows from any other index build are dropped as soon as a new version is seen
+        with self._lock:
+            if version == self._index_version:
+                return
+            deleted = self._conn.execute("DELETE FROM retrievals WHERE index_version != ?", (version,)).rowcount
+            self._conn.commit()
+            self._index_version = version
+            if deleted:
+                logger.info(f"Retrieval cache: index version changed, dropped {deleted} stale entries.")
+
+    def _retrieval_key(self, query: str, top_k: int, mode: str, config: str) -> str:
+        return f"{self._index_version}\x00{mode}\x00{top_k}\x00{config}\x00{normalize_query(query)}"
+
+    def get_retrieval(self, query: str, top_k: int, mode: str, config: str = ""):
+        # config: the ranking settings in effect (fusion weights, candidate pool, ...); any change is a miss
+        with self._lock:
+            row = self._get("retrievals", self._retrieval_key(query, top_k, mode, config))
+            if row is None:
+                self.misses["retrieval"] += 1
+                return None
+            self.hits["retrieval"] += 1
+            return json.loads(row[0])
+
+    def put_retrieval(self, query: str, top_k: int, mode: str, hits: list, config: str = ""):
+        # hits: [(node_id, score)]
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO retrievals (key, index_version, value, last_used) VALUES (?, ?, ?, ?)",
+                (self._retrieval_key(query, top_k, mode, config), self._index_version, json.dumps(hits), time.time())
+            )
+            self._evict("retrievals")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        return {"hits": dict(self.hits), "misses": dict(self.misses)}
@@ -1,16 +1,358 @@
 import os
-from llama_index.core import StorageContext, load_index_from_storage
+import re
+import time
+import hashlib
+import logging
+import resource
+import threading
+from src.config import STORAGE_DIR
+from src.ingestion.hs_codes import get_code_table, CODE_TABLE_PATH
+from src.ingestion.llama_settings import configure_settings, get_embed_model, embed_model_name
+from src.tools.lexical_index import BM25Index, LEXICAL_INDEX_PATH, reciprocal_rank_fusion
+from src.tools.heading_index import HeadingIndex, HEADING_INDEX_PATH
+from src.tools.retrieval_cache import RetrievalCache
+from src.tools.llm_calls import embed_with_limit
+from src.tools.tracing import span
 
-def get_stcced_retriever():
-    # Load from /storage
-    storage_context = StorageContext.from_defaults(persist_dir="./storage")
-    index = load_index_from_storage(storage_context)
+logger = logging.getLogger(__name__)
 
-    # Use retriever directly — no response synthesizer, no extra LLM call.
-    return index.as_retriever(similarity_top_k=5)
+SIMILARITY_TOP_K = int(os.getenv("SIMILARITY_TOP_K", "5"))
+# "vector" keeps pure embedding search, "hybrid" fuses it with BM25, "hierarchical" runs the hybrid search
+# only inside the best-ranked headings and adds the winning block's full set of 8-digit lines
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Heading subtrees searched per query in hierarchical mode
+HIERARCHY_HEADINGS = int(os.getenv("HIERARCHY_HEADINGS", "3"))
+# BM25 chunk hits whose headings vote in the heading ranking
+HEADING_LEXICAL_POOL = 50
+# Each ranker proposes this many candidates per requested result before fusion
+CANDIDATE_MULTIPLIER = int(os.getenv("CANDIDATE_MULTIPLIER", "3"))
+FUSION_VECTOR_WEIGHT = float(os.getenv("FUSION_VECTOR_WEIGHT", "1.0"))
+FUSION_LEXICAL_WEIGHT = float(os.getenv("FUSION_LEXICAL_WEIGHT", "1.0"))
+FUSION_RRF_K = int(os.getenv("FUSION_RRF_K", "60"))
+# Every setting besides query, top_k and mode that changes the ranking; part of the retrieval cache key so
+# tuning one of them doesn't keep serving rankings made under the old value
+RETRIEVAL_CONFIG = (
+    f"candidates={CANDIDATE_MULTIPLIER};weights={FUSION_VECTOR_WEIGHT},{FUSION_LEXICAL_WEIGHT};rrf_k={FUSION_RRF_K};"
+    f"headings={HIERARCHY_HEADINGS};heading_pool={HEADING_LEXICAL_POOL};nprobe={os.getenv('VECTOR_NPROBE', '')}"
+)
+# Set RETRIEVAL_CACHE=off to always embed and search
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE", "on").lower() not in ("0", "off", "false")
+# How often (seconds) the handle re-stats STORAGE_DIR to notice a rebuilt index
+STORAGE_CHECK_INTERVAL = float(os.getenv("STORAGE_CHECK_INTERVAL", "5"))
 
-def query_stcced(query: str) -> str:
-    retriever = get_stcced_retriever()
-    nodes = retriever.retrieve(query)
-    raw_chunks = [node.get_content() for node in nodes]
-    return "\n---\n".join(raw_chunks) if raw_chunks else "No relevant documents found."
\ No newline at end of file
+
+def _current_rss_mb() -> float:
+    # Resident memory of this process. /proc is exact on Linux, ru_maxrss is a peak fallback elsewhere.
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class IndexHandle:
+    # Process-wide holder for the STCCED index so workers, retries and MCP calls share one loaded copy.
+    # The JSON stores are only deserialized again when the files under persist_dir change.
+
+    def __init__(self, persist_dir: str = STORAGE_DIR):
+        self.persist_dir = persist_dir
+        self._lock = threading.RLock()
+        self._index = None
+        self._lexical = None
+        self._headings = None
+        self._fingerprint = None
+        self._last_check = 0.0
+        self.load_seconds = 0.0
+        self.load_rss_mb = 0.0
+        self.load_count = 0
+
+    def storage_ready(self) -> bool:
+        # The index and every companion file ingestion persists next to it exist, so nothing needs building
+        # before the first query and the handle can load lazily
+        required = ["docstore.json", CODE_TABLE_PATH, LEXICAL_INDEX_PATH, HEADING_INDEX_PATH]
+        return all(os.path.exists(os.path.join(self.persist_dir, os.path.basename(path))) for path in required)
+
+    def _storage_fingerprint(self):
+        if not os.path.isdir(self.persist_dir):
+            return None
+        entries = []
+        for name in sorted(os.listdir(self.persist_dir)):
+            path = os.path.join(self.persist_dir, name)
+            if os.path.isfile(path):
+                st = os.stat(path)
+                entries.append((name, st.st_mtime_ns, st.st_size))
+        return tuple(entries)
+
+    def _load(self):
+        rss_before = _current_rss_mb()
+        start = time.perf_counter()
+        # LlamaIndex and the vector store load with the index, not with this module
+        from llama_index.core import load_index_from_storage
+        from src.tools.vector_store import load_storage_context
+        configure_settings()
+        index = load_index_from_storage(load_storage_context(self.persist_dir))
+        self._adopt(index)
+        self.load_seconds = time.perf_counter() - start
+        self.load_rss_mb = _current_rss_mb() - rss_before
+        logger.info(f"STCCED index loaded from {self.persist_dir} in {self.load_seconds:.2f}s (+{self.load_rss_mb:.1f} MB RSS)")
+
+    def _adopt(self, index):
+        self._index = index
+        self._lexical = None
+        self._headings = None
+        self._fingerprint = self._storage_fingerprint()
+        self._last_check = time.monotonic()
+        self.load_count += 1
+
+    def _is_stale(self) -> bool:
+        now = time.monotonic()
+        if now - self._last_check < STORAGE_CHECK_INTERVAL:
+            return False
+        self._last_check = now
+        return self._storage_fingerprint() != self._fingerprint
+
+    def warm(self, index=None):
+        # Adopt an index that was just built/loaded (e.g. by get_or_create_index) or load it now
+        with self._lock:
+            if index is not None:
+                self._adopt(index)
+                logger.info("STCCED index handle warmed with pre-loaded index.")
+            elif self._index is None:
+                self._load()
+        return self._index
+
+    def get_index(self):
+        with self._lock:
+            if self._index is None:
+                self._load()
+            elif self._is_stale():
+                logger.info(f"Storage under {self.persist_dir} changed. Reloading index...")
+                self._load()
+            return self._index
+
+    @property
+    def version(self) -> str:
+        # Identifies the index build on disk; caches keyed on it go stale after a rebuild. Read under the lock so
+        # a concurrent reload can't pair the new index with the old fingerprint.
+        with self._lock:
+            fingerprint = self._fingerprint if self._index is not None else self._storage_fingerprint()
+        return hashlib.sha1(repr(fingerprint).encode()).hexdigest()[:12]
+
+    def get_lexical_index(self):
+        # BM25 over the same docstore. Built in memory if ingestion never persisted one.
+        with self._lock:
+            index = self.get_index()
+            if self._lexical is None:
+                path = os.path.join(self.persist_dir, os.path.basename(LEXICAL_INDEX_PATH))
+                if os.path.exists(path):
+                    self._lexical = BM25Index.load(path)
+                else:
+                    logger.warning(f"No BM25 index at {path}. Building one in memory from the docstore.")
+                    self._lexical = BM25Index.from_docstore(index.docstore)
+            return self._lexical
+
+    def get_heading_index(self):
+        # Heading centroids over the same vector store. Built in memory if ingestion never persisted them.
+        with self._lock:
+            index = self.get_index()
+            if self._headings is None:
+                path = os.path.join(self.persist_dir, os.path.basename(HEADING_INDEX_PATH))
+                if os.path.exists(path):
+                    self._headings = HeadingIndex.load(path)
+                else:
+                    logger.warning(f"No heading index at {path}. Building one in memory from the vector store.")
+                    self._headings = HeadingIndex.from_index(index)
+            return self._headings
+
+    def stats(self) -> dict:
+        # One consistent snapshot, even while another thread reloads the index
+        with self._lock:
+            return {
+                "loaded": self._index is not None,
+                "version": self.version,
+                "load_count": self.load_count,
+                "load_seconds": round(self.load_seconds, 3),
+                "load_rss_mb": round(self.load_rss_mb, 1),
+                "rss_mb": round(_current_rss_mb(), 1),
+            }
+
+
+index_handle = IndexHandle()
+_retrieval_cache = None
+_retrieval_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache():
+    # Shared on-disk query cache, opened on first use. None when disabled.
+    global _retrieval_cache
+    if not RETRIEVAL_CACHE_ENABLED:
+        return None
+    with _retrieval_cache_lock:
+        if _retrieval_cache is None:
+            _retrieval_cache = RetrievalCache()
+        return _retrieval_cache
+
+
+def lookup_hs_code(code: str) -> str:
+    # Exact lookup: the row for an 8-digit line, or every national line under a 4/6-digit heading
+    table = get_code_table()
+    if table is None:
+        return "HS code table not built. Run src/ingestion/parse.py first."
+    expanded = table.expand(code)
+    if expanded:
+        return expanded
+    entry = table.get(code)
+    return table.format_lines([entry]) if entry else f"No tariff line found for {code}."
+
+def expand_siblings(results: list) -> list:
+    # The top hit's whole block (its 6-digit subheading, or heading when it has none) from the code table.
+    # The answer is often a sibling of the line that matched best, and a long block's chunk holds only part of it.
+    table = get_code_table()
+    if table is None or not results:
+        return []
+    code = results[0].node.metadata.get("code")
+    block = table.expand(code) if code else ""
+    return [(f"hs:{code}", block)] if block else []
+
+def expand_headings(query: str) -> list:
+    # Headings named in the query are expanded from the code table instead of relying on similarity search.
+    # Returns [(chunk_id, text)] so the expansion dedupes like any other retrieved chunk.
+    table = get_code_table()
+    if table is None:
+        return []
+    blocks = []
+    for heading in dict.fromkeys(re.findall(r'\b(\d{4}\.\d{2})\b(?!\.\d)', query)):
+        block = table.expand(heading)
+        if block:
+            blocks.append((f"hs:{heading}", block))
+    return blocks
+
+def embed_query(query: str) -> list:
+    # A cached embedding is served without constructing the embedder
+    model_name = embed_model_name()
+    cache = get_retrieval_cache()
+    if cache is not None:
+        with span("cache", "query_embedding", model=model_name) as record:
+            embedding = cache.get_embedding(model_name, query)
+            record["cache_hit"] = embedding is not None
+        if embedding is not None:
+            return embedding
+    embed_model = get_embed_model()
+    embedding = embed_with_limit(embed_model, [query], lambda: embed_model.get_query_embedding(query))
+    if cache is not None:
+        cache.put_embedding(model_name, query, embedding)
+    return embedding
+
+def embed_queries(queries: list) -> dict:
+    # {query: embedding} for many queries with one embedding call for all cache misses. The embedders this
+    # index is built with (Ollama, the benchmark's hash embedder) embed queries and documents the same way,
+    # so the text batch API stands in for a per-query get_query_embedding.
+    model_name = embed_model_name()
+    cache = get_retrieval_cache()
+    embeddings, missing = {}, []
+    for query in dict.fromkeys(queries):
+        embedding = cache.get_embedding(model_name, query) if cache is not None else None
+        if embedding is not None:
+            embeddings[query] = embedding
+        else:
+            missing.append(query)
+    if missing:
+        embed_model = get_embed_model()
+        vectors = embed_with_limit(embed_model, missing, lambda: embed_model.get_text_embedding_batch(missing))
+        for query, embedding in zip(missing, vectors):
+            embeddings[query] = embedding
+            if cache is not None:
+                cache.put_embedding(model_name, query, embedding)
+    logger.info(f"Batch embedding: {len(embeddings)} queries, {len(missing)} embedded in one call.")
+    return embeddings
+
+def _heading_candidates(query: str, embedding: list):
+    # Node ids under the HIERARCHY_HEADINGS best headings: centroid similarity fused with the headings of the
+    # top BM25 chunks. None when there is no heading tree (sentence-chunked source), to search flat instead.
+    headings = index_handle.get_heading_index()
+    if not len(headings):
+        return None
+    lexical_hits = index_handle.get_lexical_index().search(query, top_k=HEADING_LEXICAL_POOL)
+    ranked = reciprocal_rank_fusion(
+        [headings.rank(embedding), headings.rank_by_hits(lexical_hits)],
+        [FUSION_VECTOR_WEIGHT, FUSION_LEXICAL_WEIGHT],
+        k=FUSION_RRF_K,
+    )
+    chosen = [heading for heading, _ in ranked[:HIERARCHY_HEADINGS]]
+    candidates = headings.nodes_under(chosen)
+    logger.info(f"Hierarchical retrieval: headings {', '.join(chosen)} ({len(candidates)} of {len(headings.heading_of)} tariff chunks).")
+    return candidates
+
+def _rank_nodes(index, query: str, top_k: int, mode: str, embedding: list = None) -> list:
+    # [(node_id, score)] best first. Hybrid mode fuses vector and BM25 rankings with weighted RRF;
+    # hierarchical mode does the same over the chunks of the best headings only.
+    from llama_index.core.schema import QueryBundle
+    pool = top_k * CANDIDATE_MULTIPLIER if mode != "vector" else top_k
+    bundle = QueryBundle(query_str=query, embedding=embedding or embed_query(query))
+    candidates = _heading_candidates(query, bundle.embedding) if mode == "hierarchical" else None
+    # Retrievers are built per query (pool size and candidate ids vary) and used directly: no response
+    # synthesizer, no extra LLM call
+    if candidates is not None:
+        vector_hits = index.as_retriever(similarity_top_k=pool, node_ids=candidates).retrieve(bundle)
+    else:
+        vector_hits = index.as_retriever(similarity_top_k=pool).retrieve(bundle)
+    if mode == "vector":
+        return [(hit.node.node_id, hit.score) for hit in vector_hits]
+
+    allowed = set(candidates) if candidates is not None else None
+    lexical_hits = index_handle.get_lexical_index().search(query, top_k=pool, allowed=allowed)
+    fused = reciprocal_rank_fusion(
+        [[hit.node.node_id for hit in vector_hits], [node_id for node_id, _ in lexical_hits]],
+        [FUSION_VECTOR_WEIGHT, FUSION_LEXICAL_WEIGHT],
+        k=FUSION_RRF_K,
+    )
+    logger.info(f"Hybrid retrieval: {len(vector_hits)} vector + {len(lexical_hits)} lexical candidates fused.")
+    return fused[:top_k]
+
+def retrieve_stcced(query: str, top_k: int = None, mode: str = None, embedding: list = None) -> list:
+    # Ranked NodeWithScore list, served from the retrieval cache when this index version has seen the query.
+    # A precomputed query embedding (see embed_queries) skips the embedding call.
+    top_k = top_k or SIMILARITY_TOP_K
+    mode = mode or RETRIEVAL_MODE
+    index = index_handle.get_index()
+
+    with span("retrieval", mode, query=query, top_k=top_k) as record:
+        cache = get_retrieval_cache()
+        hits = None
+        if cache is not None:
+            cache.set_index_version(index_handle.version)
+            hits = cache.get_retrieval(query, top_k, mode, RETRIEVAL_CONFIG)
+        record["cache_hit"] = hits is not None
+        if hits is None:
+            hits = _rank_nodes(index, query, top_k, mode, embedding)
+            if cache is not None:
+                cache.put_retrieval(query, top_k, mode, hits, RETRIEVAL_CONFIG)
+
+        from llama_index.core.schema import NodeWithScore
+        results = []
+        for node_id, score in hits:
+            node = index.docstore.get_node(node_id, raise_error=False)
+            if node is not None:
+                results.append(NodeWithScore(node=node, score=score))
+        record["results"] = len(results)
+        return results
+
+def search_stcced(query: str, embedding: list = None) -> list:
+    # [(node_id, text)] in rank order. Exact heading expansion goes first so evidence truncation never cuts it off.
+    chunks = expand_headings(query)
+    results = retrieve_stcced(query, embedding=embedding)
+    if RETRIEVAL_MODE == "hierarchical":
+        siblings = expand_siblings(results)
+        seen = {chunk_id for chunk_id, _ in chunks}
+        chunks.extend(chunk for chunk in siblings if chunk[0] not in seen)
+        if siblings:
+            # The expansion supersedes every chunk of the same block
+            code = results[0].node.metadata.get("code")
+            results = [node for node in results if node.node.metadata.get("code") != code]
+    chunks.extend((node.node.node_id, node.get_content()) for node in results)
+    return chunks
+
+def query_stcced(query: str, embedding: list = None) -> str:
+    raw_chunks = [text for _, text in search_stcced(query, embedding)]
+    return "\n---\n".join(raw_chunks) if raw_chunks else "No relevant documents found."
@@ -0,0 +1,175 @@
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from langchain_core.messages import AIMessage
+from llama_index.core.embeddings import BaseEmbedding
+from src.tools.lexical_index import tokenize
+from src.tools.token_counter import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Deterministic replacements for the chat models and the embedder, for offline benchmarks. They answer
+# each prompt the graph sends (plan, analysis, synthesis, DeepEval judge) by lexical overlap with the evidence,
+# so a run needs no network, no GPU and no API quota and gives the same result every time.
+
+EIGHT_DIGIT_LINE = re.compile(r'^.*\b\d{4}\.\d{2}\.\d{2}\b.*$', re.MULTILINE)
+SIX_DIGIT_LINE = re.compile(r'^.*\b\d{4}\.\d{2}\b.*$', re.MULTILINE)
+CODE = re.compile(r'\b(\d{4}\.\d{2}(?:\.\d{2})?)\b')
+# Claims the stand-in judge extracts from an answer. The verdict step finds them again in its prompt by this wording.
+CITED_CLAIM = "Cited tariff code {code} appears in the retrieval context."
+NO_CODE_CLAIM = "The answer cites a tariff code from the retrieval context."
+JUDGED_CLAIM = re.compile(r'Cited tariff code (\d{4}\.\d{2}(?:\.\d{2})?) appears in the retrieval context\.|' + re.escape(NO_CODE_CLAIM))
+
+
+def _between(text: str, start: str, end: str) -> str:
+    if start not in text:
+        return ""
+    text = text.split(start, 1)[1]
+    return text.split(end, 1)[0] if end in text else text
+
+
+def best_line(product: str, evidence: str):
+    # Evidence line whose description shares most words with the product; "Other" lines lose ties.
+    # None when no line shares a word, so products outside the evidence go unclassified.
+    wanted = set(tokenize(product))
+    lines = EIGHT_DIGIT_LINE.findall(evidence) or SIX_DIGIT_LINE.findall(evidence)
+    best, best_score = None, None
+    for line in lines:
+        description = CODE.sub(" ", line)
+        score = (len(wanted & set(tokenize(description))), "other" not in description.lower())
+        if score[0] and (best_score is None or score > best_score):
+            best, best_score = line.strip(), score
+    return best
+
+
+class StandInChatModel:
+    # Duck-types the parts of a LangChain chat model the graph uses: invoke/ainvoke and with_structured_output
+
+    def __init__(self, model_name: str = "stand-in", latency_ms: float = 0.0):
+        self.model_name = model_name
+        self.latency = latency_ms / 1000
+        self.calls = 0
+
+    def respond(self, prompt: str) -> str:
+        if "--- INPUT DATA ---" in prompt:
+            return self._synthesis(prompt)
+        if "RAW EVIDENCE FROM TARIFF SCHEDULE:" in prompt:
+            return self._analysis(prompt)
+        return self._judge(prompt)
+
+    def plan(self, prompt: str) -> dict:
+        product = _between(prompt, "User Query:", "\n").strip()
+        words = product.split()
+        queries = [product] + ([words[-1]] if len(words) > 1 else [])
+        return {"search_queries": queries}
+
+    def _analysis(self, prompt: str) -> str:
+        product = _between(prompt, "PRODUCT TO CLASSIFY:", "\n").strip()
+        line = best_line(product, _between(prompt, "RAW EVIDENCE FROM TARIFF SCHEDULE:", "CLASSIFICATION RULES:"))
+        if line is None:
+            return "- **Found Code**: NONE\n- **Exact Tariff Line**: NOT FOUND IN EVIDENCE"
+        code = CODE.search(line).group(1)
+        kind = "National Tariff Line (8-digit)" if len(code) == 10 else "Heading (6-digit)"
+        return (f"- **Found Code**: {code}\n- **Exact Tariff Line**: {line}\n- **Type**: {kind}\n"
+                f"- **Reasoning**: Closest description to '{product}' in the evidence.")
+
+    def _synthesis(self, prompt: str) -> str:
+        product = _between(prompt, "User Query:", "\n").strip()
+        proposed = _between(prompt, "Worker's Proposed 8-digit Code:", "\n").strip()
+        evidence = _between(prompt, "Raw Retrieved Evidence (from STCCED tariff schedule):", "REMINDER:")
+        line = next((l.strip() for l in EIGHT_DIGIT_LINE.findall(evidence) if CODE.fullmatch(proposed) and proposed in l), None)
+        line = line or best_line(product, evidence)
+        if line is None:
+            return "INSUFFICIENT DATA - MANUAL REVIEW REQUIRED"
+        code = CODE.search(line).group(1)
+        confidence = "MEDIUM" if "other" in line.lower() else "HIGH"
+        return (f"FINAL_CODE: {code}\n1. **HS Code**: {code}\n2. **Product Name**: {line}\n"
+                f"3. **Legal Justification**: The evidence reads \"{line}\".\n5. **Confidence**: {confidence}\n"
+                f"---VERIFICATION_CLAIMS---\n- Code {code} appears in the evidence.\n"
+                f"- The evidence text for {code} reads: \"{line}\".\n---END_VERIFICATION_CLAIMS---")
+
+    def _judge(self, prompt: str) -> str:
+        # DeepEval's faithfulness steps (truths, claims, verdicts, reason) each parse one key out of a JSON answer,
+        # so every answer carries all of them, worked out from the step's prompt:
+        # - truths: the tariff lines in the retrieval context
+        # - claims: one per code the answer cites, or one that can't hold when it cites none
+        # - verdicts: "yes" when the claimed code appears in the prompt outside the claims themselves, else "no"
+        judged = list(JUDGED_CLAIM.finditer(prompt))
+        context = JUDGED_CLAIM.sub(" ", prompt)
+        verdicts = [
+            {"verdict": "yes", "reason": f"{m.group(1)} is in the retrieval context."} if m.group(1) and m.group(1) in context
+            else {"verdict": "no", "reason": f"{m.group(1)} is not in the retrieval context." if m.group(1) else "The answer cites no tariff code."}
+            for m in judged
+        ]
+        codes = list(dict.fromkeys(CODE.findall(prompt)))
+        supported = sum(v["verdict"] == "yes" for v in verdicts)
+        return json.dumps({
+            "truths": [line.strip() for line in EIGHT_DIGIT_LINE.findall(prompt) or SIX_DIGIT_LINE.findall(prompt)],
+            "claims": [CITED_CLAIM.format(code=code) for code in codes] or [NO_CODE_CLAIM],
+            "verdicts": verdicts,
+            "reason": f"Stand-in judge: {supported} of {len(verdicts)} claims supported by the retrieval context.",
+        })
+
+    def _message(self, prompt) -> AIMessage:
+        self.calls += 1
+        prompt = str(prompt)
+        content = self.respond(prompt)
+        prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(content)
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": prompt_tokens, "output_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens
+        })
+
+    def invoke(self, prompt):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._message(prompt)
+
+    async def ainvoke(self, prompt):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._message(prompt)
+
+    def with_structured_output(self, schema, include_raw: bool = False):
+        return _StructuredStandIn(self, schema, include_raw)
+
+
+class _StructuredStandIn:
+    def __init__(self, model: StandInChatModel, schema, include_raw: bool):
+        self.model = model
+        self.schema = schema
+        self.include_raw = include_raw
+
+    def _result(self, raw: AIMessage, prompt):
+        parsed = self.schema(**self.model.plan(str(prompt)))
+        return {"raw": raw, "parsed": parsed, "parsing_error": None} if self.include_raw else parsed
+
+    def invoke(self, prompt):
+        return self._result(self.model.invoke(prompt), prompt)
+
+    async def ainvoke(self, prompt):
+        return self._result(await self.model.ainvoke(prompt), prompt)
+
+
+class HashEmbedding(BaseEmbedding):
+    # Feature-hashed bag of tokenize() terms: texts sharing words and codes land close together
+    dim: int = 256
+
+    def _embed(self, text: str) -> list:
+        vector = [0.0] * self.dim
+        for token in tokenize(text):
+            digest = int(hashlib.md5(token.encode()).hexdigest()[:8], 16)
+            vector[digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+
+    def _get_query_embedding(self, query: str) -> list:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> list:
+        return self._embed(text)
+
+    async def _aget_query_embedding(self, query: str) -> list:
+        return self._embed(query)
@@ -0,0 +1,35 @@
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Where process startup time goes, phase by phase. The clock starts when this module is first imported,
+# so entry points import it before anything heavy.
+_started = time.perf_counter()
+_phases = []
+
+
+@contextmanager
+def phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append((name, time.perf_counter() - started))
+
+
+def record_phase(name: str, seconds: float):
+    # For work timed elsewhere, e.g. an index load that happened lazily inside the first retrieval
+    _phases.append((name, seconds))
+
+
+def format_report() -> str:
+    lines = [f"{'PHASE':<32}{'SECONDS':>10}"]
+    lines.extend(f"{name:<32}{seconds:>10.3f}" for name, seconds in _phases)
+    lines.append(f"{'total since start':<32}{time.perf_counter() - _started:>10.3f}")
+    return "\n".join(lines)
+
+
+def log_report():
+    logger.info("Startup timing:\n" + format_report())
@@ -0,0 +1,44 @@
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Characters per token on tariff-schedule text when no tokenizer is available. Codes, dotted leaders and
+# units tokenize densely, so these sit below the usual ~4 chars/token quoted for English prose.
+CHARS_PER_TOKEN = {
+    "llama": 3.2,
+    "qwen": 3.0,
+    "gemini": 3.6,
+    "default": 3.5,
+}
+# Families whose BPE vocabulary is close enough to tiktoken's for its count to be used directly
+TIKTOKEN_FAMILIES = {"llama", "qwen", "default"}
+
+
+def model_family(model_name) -> str:
+    name = (model_name or "").lower()
+    for family in ("llama", "qwen", "gemini"):
+        if family in name:
+            return family
+    return "default"
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    # tiktoken is optional; without it every family falls back to its chars-per-token ratio
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        logger.debug("tiktoken not available, using character-ratio token estimates.")
+        return None
+
+
+def count_tokens(text: str, model_name=None) -> int:
+    if not text:
+        return 0
+    family = model_family(model_name)
+    encoding = _encoding() if family in TIKTOKEN_FAMILIES else None
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, int(len(text) / CHARS_PER_TOKEN[family] + 0.5))
@@ -0,0 +1,179 @@
+import json
+import time
+import inspect
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# The run being traced and the graph node currently executing. Context variables follow the call into
+# LangGraph's worker threads, asyncio tasks and asyncio.to_thread, so nested spans find their node.
+_current_trace = ContextVar("current_trace", default=None)
+_current_node = ContextVar("current_node", default=None)
+_token_lock = threading.Lock()
+
+SPAN_KINDS = ("node", "llm", "embedding", "retrieval", "cache")
+
+
+class Trace:
+    # Spans of one audit run. Each span is a flat dict so the whole run serializes to JSON as-is.
+
+    def __init__(self, run_id: str, query: str = ""):
+        self.run_id = run_id
+        self.query = query
+        self.started = time.time()
+        self.ended = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, record: dict):
+        with self._lock:
+            self.spans.append(record)
+
+    def node_summary(self) -> dict:
+        # {node: {calls, seconds, prompt_tokens, completion_tokens}} in first-execution order
+        summary = {}
+        for record in self.spans:
+            if record["kind"] != "node":
+                continue
+            entry = summary.setdefault(record["name"], {"calls": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0})
+            entry["calls"] += 1
+            entry["seconds"] += record["seconds"]
+            entry["prompt_tokens"] += record.get("prompt_tokens", 0)
+            entry["completion_tokens"] += record.get("completion_tokens", 0)
+        return summary
+
+    def kind_summary(self) -> dict:
+        # Totals per span kind, plus the time LLM calls spent waiting on the rate limiter
+        summary = {}
+        for record in self.spans:
+            entry = summary.setdefault(record["kind"], {"calls": 0, "seconds": 0.0, "cache_hits": 0})
+            entry["calls"] += 1
+            entry["seconds"] += record["seconds"]
+            entry["cache_hits"] += 1 if record.get("cache_hit") else 0
+            if record["kind"] == "llm":
+                entry["rate_limit_wait"] = entry.get("rate_limit_wait", 0.0) + record.get("rate_limit_wait", 0.0)
+        return summary
+
+    def to_dict(self) -> dict:
+        return {
+            "run_id": self.run_id,
+            "query": self.query,
+            "started": self.started,
+            "ended": self.ended,
+            "seconds": (self.ended or time.time()) - self.started,
+            "nodes": self.node_summary(),
+            "kinds": self.kind_summary(),
+            "spans": sorted(self.spans, key=lambda record: record["start"]),
+        }
+
+    def export(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+        logger.info(f"Trace for run {self.run_id} written to {path} ({len(self.spans)} spans).")
+
+    def format_report(self) -> str:
+        lines = [f"{'NODE':<28}{'CALLS':>6}{'SECONDS':>10}{'PROMPT':>9}{'COMPL':>8}"]
+        for name, entry in self.node_summary().items():
+            lines.append(f"{name:<28}{entry['calls']:>6}{entry['seconds']:>10.2f}{entry['prompt_tokens']:>9}{entry['completion_tokens']:>8}")
+        for kind, entry in self.kind_summary().items():
+            if kind == "node":
+                continue
+            line = f"- {kind}: {entry['calls']} calls, {entry['seconds']:.2f}s, {entry['cache_hits']} cache hits"
+            if "rate_limit_wait" in entry:
+                line += f", {entry['rate_limit_wait']:.2f}s rate-limit wait"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+@contextmanager
+def trace_run(run_id: str, query: str = ""):
+    # Everything called inside the block (including graph nodes on other threads) records into this trace
+    trace = Trace(run_id, query)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.ended = time.time()
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(kind: str, name: str, **attrs):
+    # Yields the span dict so the caller can add attributes (tokens, cache_hit, ...) while it runs.
+    # Outside a traced run the span is still built, so callers never need to check, but it is not kept.
+    node = _current_node.get()
+    record = {"kind": kind, "name": name, "start": time.time(), **attrs}
+    if node is not None and kind != "node":
+        record.setdefault("node", node["name"])
+        record.setdefault("attempt", node.get("attempt"))
+    started = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["end"] = time.time()
+        record["seconds"] = time.perf_counter() - started
+        if kind == "llm" and node is not None:
+            # Roll the call's usage up into the node that made it; a node may make several calls at once
+            with _token_lock:
+                node["prompt_tokens"] = node.get("prompt_tokens", 0) + record.get("prompt_tokens", 0)
+                node["completion_tokens"] = node.get("completion_tokens", 0) + record.get("completion_tokens", 0)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(record)
+
+
+def record_usage(record: dict, response):
+    # Copy provider-reported token usage (LangChain usage_metadata) onto an llm span
+    usage = getattr(response, "usage_metadata", None) or {}
+    record["prompt_tokens"] = usage.get("input_tokens", 0)
+    record["completion_tokens"] = usage.get("output_tokens", 0)
+    if not record["prompt_tokens"] and not record["completion_tokens"]:
+        record["prompt_tokens"] = usage.get("total_tokens", 0)
+
+
+def _node_tokens(record: dict) -> int:
+    return record.get("prompt_tokens", 0) + record.get("completion_tokens", 0)
+
+
+def traced_node(name: str, fn):
+    # Wrap a graph node: one span per execution, and the node's LLM token usage (the calls it made,
+    # DeepEval's judge included) is returned as its total_tokens increment
+    def open_span(state):
+        attempt = state.get("attempt", state.get("step_count", 0)) if isinstance(state, dict) else None
+        return span("node", name, attempt=attempt)
+
+    def finish(record, update):
+        tokens = _node_tokens(record)
+        if tokens and isinstance(update, dict):
+            update = {**update, "total_tokens": tokens}
+        return update
+
+    if inspect.iscoroutinefunction(fn):
+        @wraps(fn)
+        async def async_wrapper(state):
+            with open_span(state) as record:
+                token = _current_node.set(record)
+                try:
+                    update = await fn(state)
+                finally:
+                    _current_node.reset(token)
+            return finish(record, update)
+        return async_wrapper
+
+    @wraps(fn)
+    def wrapper(state):
+        with open_span(state) as record:
+            token = _current_node.set(record)
+            try:
+                update = fn(state)
+            finally:
+                _current_node.reset(token)
+        return finish(record, update)
+    return wrapper
@@ -0,0 +1,261 @@
+import os
+import json
+import logging
+from typing import Any, List, Optional
+import numpy as np
+from llama_index.core import StorageContext
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.types import BasePydanticVectorStore, VectorStoreQuery, VectorStoreQueryResult
+
+logger = logging.getLogger(__name__)
+
+# "simple" keeps LlamaIndex's JSON vector store; "mmap" stores embeddings as one memory-mapped NumPy matrix
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "simple")
+# float16 halves the file and page-cache footprint; rows are upcast per block at query time
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")
+# IVF lists built at persist time (0 = exact search only). More lists = smaller probes = faster, lower recall.
+VECTOR_IVF_LISTS = int(os.getenv("VECTOR_IVF_LISTS", "0"))
+# Lists scanned per query: the recall-vs-latency knob. nprobe == lists is exact.
+VECTOR_NPROBE = int(os.getenv("VECTOR_NPROBE", "8"))
+
+MATRIX_FILE = "vectors.npy"
+META_FILE = "vectors_meta.json"
+IVF_FILE = "vectors_ivf.npz"
+SIMPLE_STORE_FILE = "default__vector_store.json"
+# Rows scored per matrix product during an exact scan, bounding the float32 temporary for float16 matrices
+SCAN_BLOCK_ROWS = 8192
+KMEANS_ITERATIONS = 10
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=-1, keepdims=True), 1e-12)
+
+
+def _top_k(scores: np.ndarray, rows: np.ndarray, k: int):
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        scores, rows = scores[best], rows[best]
+    order = np.argsort(-scores)
+    return rows[order], scores[order]
+
+
+def build_ivf(matrix: np.ndarray, lists: int, seed: int = 0):
+    # Spherical k-means over the normalized rows. Returns (centroids, order, offsets): the rows of list i are
+    # order[offsets[i]:offsets[i + 1]], so a probe reads each list as one contiguous slice of indices.
+    n = matrix.shape[0]
+    lists = max(1, min(lists, n))
+    rng = np.random.default_rng(seed)
+    centroids = np.asarray(matrix[rng.choice(n, lists, replace=False)], dtype=np.float32)
+    assign = np.zeros(n, dtype=np.int32)
+    for _ in range(KMEANS_ITERATIONS):
+        for start in range(0, n, SCAN_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+            assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, np.asarray(matrix, dtype=np.float32))
+        empty = np.bincount(assign, minlength=lists) == 0
+        sums[empty] = centroids[empty]
+        centroids = _normalize(sums)
+    order = np.argsort(assign, kind="stable").astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=lists))]).astype(np.int64)
+    return centroids, order, offsets
+
+
+class MmapVectorStore(BasePydanticVectorStore):
+    # Embeddings as a contiguous, row-normalized matrix (cosine = dot product), memory-mapped read-only at load.
+    # Node ids and ref doc ids live in a small JSON side file; text and metadata stay in the docstore.
+    # Adds and deletes work on an in-memory copy until the next persist rewrites the files.
+
+    stores_text: bool = False
+    is_embedding_query: bool = True
+    dtype: str = VECTOR_DTYPE
+    ivf_lists: int = VECTOR_IVF_LISTS
+    nprobe: int = VECTOR_NPROBE
+
+    _matrix: Any = PrivateAttr(default=None)
+    _ids: List[str] = PrivateAttr(default_factory=list)
+    _doc_ids: List[Optional[str]] = PrivateAttr(default_factory=list)
+    _ivf: Any = PrivateAttr(default=None)
+    _row_of: Any = PrivateAttr(default=None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MmapVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, **kwargs) -> "MmapVectorStore":
+        store = cls(**kwargs)
+        with open(os.path.join(persist_dir, META_FILE), "r") as f:
+            meta = json.load(f)
+        store.dtype = meta.get("dtype", store.dtype)
+        store._ids = meta["ids"]
+        store._doc_ids = meta["doc_ids"]
+        store._matrix = np.load(os.path.join(persist_dir, MATRIX_FILE), mmap_mode="r")
+        ivf_path = os.path.join(persist_dir, IVF_FILE)
+        if os.path.exists(ivf_path):
+            with np.load(ivf_path) as ivf:
+                lists = int(ivf["lists"]) if "lists" in ivf.files else len(ivf["centroids"])
+                if lists == store.ivf_lists:
+                    store._ivf = (ivf["centroids"], ivf["order"], ivf["offsets"])
+                else:
+                    # Built for another VECTOR_IVF_LISTS; rebuilt on first use and written at the next persist
+                    logger.info(f"Vector store: IVF on disk has {lists} lists, {store.ivf_lists} configured.")
+        return store
+
+    @classmethod
+    def from_simple_store(cls, simple: SimpleVectorStore, **kwargs) -> "MmapVectorStore":
+        # Migrate an existing JSON vector store without re-embedding anything
+        store = cls(**kwargs)
+        data = simple.data
+        store._ids = list(data.embedding_dict.keys())
+        store._doc_ids = [data.text_id_to_ref_doc_id.get(node_id) for node_id in store._ids]
+        if store._ids:
+            store._matrix = _normalize([data.embedding_dict[node_id] for node_id in store._ids]).astype(store.dtype)
+        return store
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _rows_by_id(self) -> dict:
+        # node id → matrix row, rebuilt after adds and deletes
+        if self._row_of is None:
+            self._row_of = {node_id: i for i, node_id in enumerate(self._ids)}
+        return self._row_of
+
+    def _current_ivf(self):
+        # The IVF lists for ivf_lists, built in memory when none matching were loaded. None below the size
+        # where probing pays off, so small stores are always searched exactly.
+        if not self.ivf_lists or len(self._ids) <= self.ivf_lists:
+            return None
+        if self._ivf is None:
+            self._ivf = build_ivf(self._matrix, self.ivf_lists)
+        return self._ivf
+
+    def get(self, text_id: str) -> Optional[List[float]]:
+        # Same lookup SimpleVectorStore offers; rows come back normalized
+        row = self._rows_by_id().get(text_id)
+        return None if row is None else np.asarray(self._matrix[row], dtype=np.float32).tolist()
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        rows = _normalize([node.get_embedding() for node in nodes]).astype(self.dtype)
+        self._matrix = rows if self._matrix is None else np.concatenate([np.asarray(self._matrix), rows])
+        self._ids.extend(node.node_id for node in nodes)
+        self._doc_ids.extend(node.ref_doc_id for node in nodes)
+        self._ivf = self._row_of = None
+        return [node.node_id for node in nodes]
+
+    def _keep(self, mask: np.ndarray):
+        if not self._ids:
+            return
+        self._matrix = np.asarray(self._matrix)[mask]
+        self._ids = [node_id for node_id, keep in zip(self._ids, mask) if keep]
+        self._doc_ids = [doc_id for doc_id, keep in zip(self._doc_ids, mask) if keep]
+        self._ivf = self._row_of = None
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._keep(np.array([doc_id != ref_doc_id for doc_id in self._doc_ids], dtype=bool))
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters=None, **delete_kwargs: Any) -> None:
+        if filters is not None:
+            raise NotImplementedError("MmapVectorStore does not support metadata filters.")
+        drop = set(node_ids or [])
+        self._keep(np.array([node_id not in drop for node_id in self._ids], dtype=bool))
+
+    def _scan(self, query: np.ndarray, rows: Optional[np.ndarray], k: int):
+        # Exact scores over all rows (or the given subset), block by block
+        if rows is None:
+            rows = np.arange(len(self._ids))
+        all_scores = []
+        for start in range(0, len(rows), SCAN_BLOCK_ROWS):
+            block_rows = rows[start:start + SCAN_BLOCK_ROWS]
+            if len(block_rows) and block_rows[-1] - block_rows[0] == len(block_rows) - 1:
+                block = self._matrix[block_rows[0]:block_rows[-1] + 1]  # contiguous: a plain slice of the mmap
+            else:
+                block = self._matrix[block_rows]
+            all_scores.append(np.asarray(block, dtype=np.float32) @ query)
+        scores = np.concatenate(all_scores) if all_scores else np.zeros(0, dtype=np.float32)
+        return _top_k(scores, rows, k)
+
+    def _probe_rows(self, query: np.ndarray) -> np.ndarray:
+        centroids, order, offsets = self._current_ivf()
+        nprobe = max(1, min(self.nprobe, len(centroids)))
+        probed = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        return np.sort(np.concatenate([order[offsets[i]:offsets[i + 1]] for i in probed]))
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise NotImplementedError("MmapVectorStore does not support metadata filters.")
+        if not self._ids or query.query_embedding is None:
+            return VectorStoreQueryResult(nodes=None, similarities=[], ids=[])
+        vector = _normalize(query.query_embedding)
+        k = max(1, query.similarity_top_k)
+
+        rows = None
+        if query.node_ids:
+            # Sorted and deduplicated, so runs of neighbouring rows are read as contiguous slices of the mmap
+            row_of = self._rows_by_id()
+            rows = np.unique(np.array([row_of[i] for i in query.node_ids if i in row_of], dtype=np.int64))
+        elif self._current_ivf() is not None:
+            rows = self._probe_rows(vector)
+        top_rows, scores = self._scan(vector, rows, k)
+        return VectorStoreQueryResult(
+            nodes=None,
+            similarities=[float(s) for s in scores],
+            ids=[self._ids[i] for i in top_rows],
+        )
+
+    def persist(self, persist_path: str, fs=None) -> None:
+        # persist_path is the per-store JSON path StorageContext hands every vector store; the matrix and its
+        # side files are written next to it instead
+        persist_dir = os.path.dirname(persist_path) or "."
+        os.makedirs(persist_dir, exist_ok=True)
+        matrix = np.asarray(self._matrix if self._matrix is not None else np.zeros((0, 0)), dtype=self.dtype)
+        # Write to a temp name and swap, so a reader mapping the old file is never handed a half-written one
+        tmp = os.path.join(persist_dir, MATRIX_FILE + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, matrix)
+        os.replace(tmp, os.path.join(persist_dir, MATRIX_FILE))
+        with open(os.path.join(persist_dir, META_FILE), "w") as f:
+            json.dump({"ids": self._ids, "doc_ids": self._doc_ids, "dtype": self.dtype, "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0}, f)
+
+        ivf_path = os.path.join(persist_dir, IVF_FILE)
+        if self._current_ivf() is not None:
+            centroids, order, offsets = self._ivf
+            # The configured list count is stored so a later change of VECTOR_IVF_LISTS is noticed at load
+            np.savez(ivf_path, centroids=centroids, order=order, offsets=offsets, lists=self.ivf_lists)
+            logger.info(f"Vector store: IVF with {len(centroids)} lists over {len(self._ids)} vectors (nprobe={self.nprobe}).")
+        elif os.path.exists(ivf_path):
+            os.remove(ivf_path)
+        logger.info(f"Vector store: {len(self._ids)} vectors written to {persist_dir} as {self.dtype}.")
+
+
+def new_storage_context() -> StorageContext:
+    # Storage for a fresh build with the configured backend
+    if VECTOR_BACKEND == "mmap":
+        return StorageContext.from_defaults(vector_store=MmapVectorStore())
+    return StorageContext.from_defaults()
+
+
+def load_storage_context(persist_dir: str) -> StorageContext:
+    # Storage for an existing index. Whatever format is on disk is what gets loaded; switching to mmap over an
+    # index persisted by the JSON store migrates its vectors once instead of forcing a re-embed.
+    if os.path.exists(os.path.join(persist_dir, META_FILE)):
+        return StorageContext.from_defaults(persist_dir=persist_dir, vector_store=MmapVectorStore.from_persist_dir(persist_dir))
+    if VECTOR_BACKEND != "mmap":
+        return StorageContext.from_defaults(persist_dir=persist_dir)
+
+    simple_path = os.path.join(persist_dir, SIMPLE_STORE_FILE)
+    logger.info(f"Vector store: migrating {simple_path} to a memory-mapped matrix...")
+    store = MmapVectorStore.from_simple_store(SimpleVectorStore.from_persist_path(simple_path))
+    store.persist(simple_path)
+    os.remove(simple_path)
+    return StorageContext.from_defaults(persist_dir=persist_dir, vector_store=MmapVectorStore.from_persist_dir(persist_dir))
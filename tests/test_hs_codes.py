@@ -0,0 +1,42 @@
+from src.ingestion.hs_codes import HSCodeTable, parse_rows
+
+SAMPLE = """84.71 Automatic data processing machines and units thereof
+8471.30 - Portable automatic data processing machines, weighing not more than 10 kg:
+8471.30.10 - - Handheld computers including palmtops u 0%
+8471.30.90 - - Other u 0%
+5407.10 - Woven fabrics of high tenacity yarn, of a width exceeding 30 m:
+5407.10.10 - - Tyre fabrics of a width not exceeding 3 m m2 5%
+"""
+
+
+def rows():
+    return {row["code"]: row for row in parse_rows(SAMPLE)}
+
+
+def test_unit_inside_description_is_not_the_unit_column():
+    row = rows()["8471.30"]
+    assert row["description"] == "Portable automatic data processing machines, weighing not more than 10 kg"
+    assert row["unit"] == ""
+    assert row["duty"] == ""
+
+
+def test_unit_and_duty_columns_are_split_off():
+    row = rows()["5407.10.10"]
+    assert row["description"] == "Tyre fabrics of a width not exceeding 3 m"
+    assert row["unit"] == "m2"
+    assert row["duty"] == "5%"
+    assert rows()["8471.30.10"]["unit"] == "u"
+
+
+def test_expand_leaf_code_lists_the_line_once():
+    table = HSCodeTable({code: row for code, row in rows().items()})
+    assert table.expand("8471.30.10") == "8471.30.10 Handheld computers including palmtops [u]"
+
+
+def test_expand_subheading_puts_header_first():
+    table = HSCodeTable({code: row for code, row in rows().items()})
+    assert table.expand("847130").splitlines() == [
+        "8471.30 Portable automatic data processing machines, weighing not more than 10 kg",
+        "8471.30.10 Handheld computers including palmtops [u]",
+        "8471.30.90 Other [u]",
+    ]
@@ -0,0 +1,44 @@
+from src.agents.verifier import verify_claims, code_in_evidence, PASS, FAIL, UNDECIDED
+
+EVIDENCE = """8518.30 - Headphones and earphones, whether or not combined with a microphone:
+8518.30.10 - - Headphones u 0%
+8518.30.20 - - Earphones u 0%
+8518.30.59 - - - Other u 0%
+8518.10.11 - - - Microphones having a frequency range of 300 Hz to 3.4 KHz u 0%"""
+
+
+def verdict(final_code: str, quote: str) -> str:
+    return verify_claims(f"FINAL_CODE: {final_code}", f"**Exact Tariff Line**: {quote}", EVIDENCE)[0]
+
+
+def test_full_quote_of_the_cited_line_passes():
+    assert verdict("8518.30.10", "8518.30.10 - - Headphones u 0%") == PASS
+
+
+def test_quote_with_most_of_a_long_description_passes():
+    assert verdict("8518.10.11", "8518.10.11 Microphones having a frequency range of 300 Hz") == PASS
+
+
+def test_quote_of_a_short_description_needs_all_of_it():
+    assert verdict("8518.30.59", "8518.30.59 - - - Other u 0%") == PASS
+
+
+def test_code_missing_from_evidence_fails():
+    assert verdict("8518.30.90", "8518.30.90 - - Other u 0%") == FAIL
+
+
+def test_trivial_quotes_are_left_to_the_judge():
+    assert verdict("8518.30.10", "u") == UNDECIDED
+    assert verdict("8518.30.59", "Other") == UNDECIDED
+    assert verdict("8518.30.10", "8518.30.10 u 0%") == UNDECIDED
+
+
+def test_quote_of_another_line_is_left_to_the_judge():
+    assert verdict("8518.30.10", "8518.30.20 - - Earphones u 0%") == UNDECIDED
+    assert verdict("8518.10.11", "8518.10.11 Microphones") == UNDECIDED
+
+
+def test_subheading_final_code_is_left_to_the_judge():
+    # 8518.30 is a prefix of the 8518.30.10 line in the evidence, but it isn't a national tariff line
+    assert verdict("8518.30", "8518.30.10 - - Headphones u 0%") == UNDECIDED
+    assert not code_in_evidence("8518.30", "8518.30.10 - - Headphones u 0%")